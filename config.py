@@ -11,17 +11,69 @@ class Config:
     audio_pin = 17
     wake_led_pin = 4
     tts_speed = 1.075
+    tts_workers = 2
+    stream_responses = True
+    tool_workers = 4
+    tool_timeout = 15  # seconds
+    # tools that write have no deadline, cutting one off after its write went
+    # through would have the model repeat it
+    tool_timeouts = {
+        "describe_user_view": 30,
+        "calculate_emissions": None,
+        "calculate_emissions_batch": None,
+        "make_pledge": None,
+    }
+    # read the values most turns ask for while the query is transcribed
+    prefetch_tools = True
+    preroll_seconds = 0.5
+    silence_threshold_db = -32.0
+    # seconds of silence that end a query early, off so releasing the button does
+    auto_stop_silence_seconds = None
+    transcribe_while_recording = True
+    transcription_workers = 2
+    transcription_segment_seconds = 4
+    transcription_overlap_seconds = 1
     chat_temperature = 0.7
+    # tokens of conversation history resent with every query
+    thread_token_budget = 2000
+    thread_tool_output_chars = 200
     max_vision_tokens = 130
     vision_temperature = 0.2
-    tts_file_format = "mp3"
+    tts_file_format = "pcm"  # raw 24kHz 16 bit mono, playable without decoding
+    tts_sample_rate = 24000
     wake_signal_audio = "dearearth.mp3"
     audio_input_file = "input_query.wav"
     data_dir = Path.cwd().parent / "data"
+    query_cache_file = data_dir / "query-cache.sqlite"
+    query_cache_size = 1024
+    query_cache_ttl = 60 * 60 * 24 * 7  # seconds
+    emitting_activities_ttl = 60 * 10  # seconds
+    embedding_cache_file = data_dir / "embedding-cache.sqlite"
+    embedding_cache_size = 4096
+    emission_factor_embedding_path = "embedding"
+    # search the emission factor catalog in memory instead of with atlas
+    local_factor_index = False
+    factor_name_lookup = True
+    http_pool_size = 4
+    http_retries = 3
+    http_connect_timeout = 3.05
+    http_read_timeout = 10
     image_input_file = "current_view.jpg"
     audio_output_file = "audio_response.mp3"
     greenhouse_gasses = ["co2", "ch4", "n2o"]
+    # update pledges' impact in the background as their periods pass
+    keep_pledges = True
+    # or compute it when read, writing it back only at startup
+    accrue_pledges = False
+    # invalidate the cached savior profile through a change stream,
+    # needs mongo running as a replica set
+    watch_savior_profile = False
+    ensure_indexes = True
+    # raise at startup if a hot query would scan a whole collection
+    check_query_plans = os.environ.get("CHECK_QUERY_PLANS") == "1"
     api_data_version = os.environ.get("API_DATA_VERSION")
+    # write recordings and responses to disk, only for debugging
+    debug_audio_files = os.environ.get("DEBUG_AUDIO_FILES") == "1"
         
 # @atexit.register
 # def cleanup_files():
@@ -0,0 +1,185 @@
+import json
+import time
+import sqlite3
+from pathlib import Path
+from numbers import Number
+from threading import Lock
+from collections import OrderedDict
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """An in-memory LRU cache whose entries expire `ttl` seconds after
+    being stored. Keeps count of its hits and misses"""
+
+    __slots__ = ("maxsize", "ttl", "hits", "misses", "_entries", "_lock")
+
+    def __init__(self, maxsize: int = 128, ttl: Number | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def expired(self, stored: Number) -> bool:
+        return self.ttl is not None and time.time() - stored > self.ttl
+
+    def _get(self, key: Hashable) -> tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None
+        stored, value = entry
+        if self.expired(stored):
+            del self._entries[key]
+            return False, None
+        self._entries.move_to_end(key)
+        return True, value
+
+    def _set(self, key: Hashable, value: Any, stored: Number) -> None:
+        self._entries[key] = (stored, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            found, value = self._get(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._set(key, value, time.time())
+
+    def invalidate(self, key: Hashable | None = None) -> None:
+        """Drops one entry, or every entry when no key is given"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def cache_info(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "maxsize": self.maxsize,
+            "currsize": len(self._entries),
+        }
+
+
+class PersistentCache(TTLCache):
+    """A TTLCache backed by a sqlite file so entries survive restarts.
+    Keys and values must be json serializable, tuple keys are fine.
+    The file, and its directory, are created on first use. Last use times
+    are kept in memory, and written on the next set, or on close"""
+
+    __slots__ = ("path", "_db", "_used")
+
+    def __init__(self, path: str, maxsize: int = 1024, ttl: Number | None = None):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.path = str(path)
+        self._db = None
+        self._used = {}
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        if self._db is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            db = sqlite3.connect(self.path, check_same_thread=False)
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache "
+                "(key TEXT PRIMARY KEY, value TEXT, stored REAL, used REAL)"
+            )
+            db.commit()
+            self._db = db
+        return self._db
+
+    def close(self) -> None:
+        with self._lock:
+            if self._db is not None:
+                self._write_used()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            found, value = self._get(key)
+            if found:
+                # eviction from the file is by last use, hits in memory count
+                self._touch(json.dumps(key))
+            else:
+                found, value = self._load(key)
+            if found:
+                self.hits += 1
+                return value
+            self.misses += 1
+            return default
+
+    def _touch(self, db_key: str) -> None:
+        self._used[db_key] = time.time()
+
+    def _write_used(self) -> None:
+        """Writes the pending last use times, the caller commits"""
+        if self._used:
+            self.db.executemany(
+                "UPDATE cache SET used = ? WHERE key = ?",
+                [(used, db_key) for db_key, used in self._used.items()],
+            )
+            self._used.clear()
+
+    def _load(self, key: Hashable) -> tuple[bool, Any]:
+        db_key = json.dumps(key)
+        row = self.db.execute(
+            "SELECT value, stored FROM cache WHERE key = ?", (db_key,)
+        ).fetchone()
+        if row is None:
+            return False, None
+        value, stored = json.loads(row[0]), row[1]
+        if self.expired(stored):
+            self.db.execute("DELETE FROM cache WHERE key = ?", (db_key,))
+            self.db.commit()
+            return False, None
+        self._touch(db_key)
+        self._set(key, value, stored)
+        return True, value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            now, db_key = time.time(), json.dumps(key)
+            self._set(key, value, now)
+            self._used.pop(db_key, None)
+            self.db.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)",
+                (db_key, json.dumps(value), now, now),
+            )
+            self._write_used()
+            # least recently used entries past maxsize are evicted
+            self.db.execute(
+                "DELETE FROM cache WHERE key NOT IN "
+                "(SELECT key FROM cache ORDER BY used DESC LIMIT ?)",
+                (self.maxsize,),
+            )
+            self.db.commit()
+
+    def invalidate(self, key: Hashable | None = None) -> None:
+        super().invalidate(key)
+        with self._lock:
+            if key is None:
+                self._used.clear()
+                self.db.execute("DELETE FROM cache")
+            else:
+                self._used.pop(json.dumps(key), None)
+                self.db.execute(
+                    "DELETE FROM cache WHERE key = ?", (json.dumps(key),)
+                )
+            self.db.commit()
+
+    def cache_info(self) -> dict:
+        (size,) = self.db.execute("SELECT COUNT(*) FROM cache").fetchone()
+        return {**super().cache_info(), "currsize": size}
@@ -1,25 +1,81 @@
-from root.device.audio import AudioTools
-from root.model.model import Model
+from root.startup import StartupTimer
 from config import Config
 from gpiozero import Button, LED
 from io import BytesIO
+from queue import Queue
+from threading import Thread, Event
 
 class Amulet:
-    __slots__ = ("model", "camera", "audio_tools")
+    __slots__ = (
+        "camera",
+        "audio_tools",
+        "image_file",
+        "stream_responses",
+        "startup",
+        "_model",
+        "_model_ready",
+        "_model_error",
+    )
 
     def __init__(self, savior_id: str):
+        """Starts up in stages: the button and the wake path come up first,
+        the model and its clients are warmed up in a background thread
+        """
+        # the main thread and the warm-up thread
+        startup = StartupTimer(parties=2)
+        self.startup = startup
         config = Config()
+        with startup.phase("gpio"):
+            audio_button = Button(config.audio_pin, pull_up=False)
+            wake_led = LED(config.wake_led_pin)
+            audio_button.when_released = self.handle_query
+        self.image_file = config.image_input_file
+        self.stream_responses = config.stream_responses
+        self._model, self._model_error = None, None
+        self._model_ready = Event()
+        Thread(
+            target=self.warm_up, args=(savior_id,), name="warm-up", daemon=True
+        ).start()
+        with startup.phase("audio"):
+            from root.device.audio import AudioTools
+
+            self.audio_tools = AudioTools(
+                button=audio_button,
+                led=wake_led,
+                transcribe=lambda audio: self.model.audio_to_text(audio),
+            )
+        startup.done()
+
+    def warm_up(self, savior_id: str) -> None:
+        """Imports and builds the model, its api and database clients
+        and the emission calculator's tables"""
+        startup = self.startup
         amulet_tools = {
             "get_view": self.get_view,
             "reject_query": self.reject_query,
             "respond_to_user": self.respond
         }
-        self.model = Model(savior_id=savior_id, amulet_tools=amulet_tools)
-        audio_button = Button(config.audio_pin, pull_up=False)
-        wake_led = LED(config.wake_led_pin)
-        audio_button.when_released = self.handle_query
-        self.image_file = config.image_input_file
-        self.audio_tools = AudioTools(button=audio_button, led=wake_led)
+        try:
+            with startup.phase("import model"):
+                from root.model.model import Model
+            with startup.phase("model"):
+                model = Model(savior_id=savior_id, amulet_tools=amulet_tools)
+            with startup.phase("cpi table"):
+                model.model_tools.ghg_calculator.consumer_price_index
+            self._model = model
+        except Exception as e:
+            self._model_error = e
+        finally:
+            self._model_ready.set()
+            startup.done()
+
+    @property
+    def model(self):
+        """The model, waiting for it to finish warming up if needed"""
+        self._model_ready.wait()
+        if self._model_error is not None:
+            raise self._model_error
+        return self._model
 
     def adjust_volume(self):
         pass
@@ -42,16 +98,49 @@ class Amulet:
     def respond(self, response: str) -> None:
         self.audio_tools.audio_playback(response)
 
+    def play_responses(self, speech_queue: Queue) -> None:
+        """Plays the model's synthesized sentences in order as they finish,
+        until it signals the end of its response with None
+        """
+        player = self.audio_tools.player
+        generation = player.generation
+        while (clip := speech_queue.get()) is not None:
+            if player.generation != generation:
+                continue  # cut off by a new press, drain the rest unplayed
+            try:
+                self.audio_tools.audio_playback(clip.result())
+            except Exception:
+                self.reject_query()
+
     def handle_query(self) -> None:
         """On release of the sensor, this function calls the model
         with the recorded audio and then plays back its response, if any
         """
+        if not self.audio_tools.has_speech:
+            return self.reject_query()
         try:
-            audio_file = self.audio_tools.output_file
-            audio_output = self.model(audio_file=audio_file)
-            print(self.model.current_thread)
-            if audio_output:
-                self.audio_tools.audio_playback(audio_output)
+            recording = self.audio_tools.recording
+            model = self.model
+            if model.prefetch_tools:
+                # the reads overlap the end of the transcription
+                model.model_tools.prefetch()
+            try:
+                text = self.audio_tools.transcript
+            except Exception:
+                # a segment failed, the whole recording is transcribed instead
+                text = model.audio_to_text(recording)
+            if self.stream_responses:
+                speech_queue = Queue()
+                player = Thread(
+                    target=self.play_responses, args=(speech_queue,), daemon=True
+                )
+                player.start()
+                model(audio_input=recording, speech_queue=speech_queue, text=text)
+                player.join()
+            else:
+                audio_output = model(audio_input=recording, text=text)
+                if audio_output:
+                    self.audio_tools.audio_playback(audio_output)
         except Exception:
             self.reject_query()
             
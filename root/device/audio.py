@@ -1,8 +1,14 @@
 import wave
-import subprocess
 import pyaudio
+from io import BytesIO
+from collections import deque
+from queue import Queue, Empty
+from typing import Callable
 from gpiozero import Button, LED
 from config import Config
+from root.device.transcription import IncrementalTranscriber
+from root.device.playback import AudioPlayer
+from root.device import vad
 import numpy as np
 from numbers import Number
 
@@ -16,27 +22,75 @@ class AudioTools:
         "output_file",
         "button",
         "wake_signal",
+        "transcriber",
+        "segment_seconds",
+        "overlap_seconds",
+        "engine",
+        "input_stream",
+        "sample_width",
+        "_ring",
+        "_capture",
+        "vad",
+        "has_speech",
+        "recording",
+        "debug_audio_files",
+        "player",
+        "tts_format",
     )
 
-    def __init__(self, button: Button, led: LED):
+    def __init__(
+        self, button: Button, led: LED, transcribe: Callable[[BytesIO], str] = None
+    ):
+        # one PortAudio engine for the life of the device, initializing
+        # and enumerating devices is slow on a pi
+        self.engine = pyaudio.PyAudio()
         params = self.p.get_default_input_device_info()
         self.channels = int(params["maxInputChannels"])
         self.sample_rate = int(params["defaultSampleRate"])
         self.chunk = 128  # TODO: FIGURE OUT A GOOD NUMBER
         self.format = pyaudio.paInt16
+        self.sample_width = self.p.get_sample_size(self.format)
         button.when_pressed = self.record_and_write
         config = Config()
+        # the last `preroll_seconds` of audio before a press are kept
+        preroll_chunks = int(config.preroll_seconds * self.sample_rate / self.chunk)
+        self._ring = deque(maxlen=max(preroll_chunks, 1))
+        self._capture = None
+        self.input_stream = self.open_input_stream()
+        self.vad = vad.VoiceActivityDetector(
+            sample_rate=self.sample_rate,
+            channels=self.channels,
+            threshold_db=config.silence_threshold_db,
+            auto_stop_seconds=config.auto_stop_silence_seconds,
+        )
+        self.has_speech = False
+        self.recording = None
+        self.debug_audio_files = config.debug_audio_files
         self.output_file = config.audio_input_file
-        self.wake_signal = config.wake_signal_audio
+        self.player = AudioPlayer(
+            engine=self.engine, sample_rate=config.tts_sample_rate
+        )
+        self.tts_format = config.tts_file_format
+        # decoded once, it plays on every press
+        self.wake_signal = self.player.load(config.wake_signal_audio)
+        # transcribe overlapping segments while the button is still held
+        self.transcriber = (
+            IncrementalTranscriber(
+                transcribe=transcribe, max_workers=config.transcription_workers
+            )
+            if transcribe and config.transcribe_while_recording
+            else None
+        )
+        self.segment_seconds = config.transcription_segment_seconds
+        self.overlap_seconds = config.transcription_overlap_seconds
         # self.led = led
         
     def get_rms(self, buffer: bytes):
-        audio = np.frombuffer(buffer, dtype=np.int16).astype(np.float32)
-        rms = np.sqrt(np.mean(np.square(audio)))
-        return rms
+        audio = np.frombuffer(buffer, dtype=np.int16)
+        return vad.get_rms(audio)
     
     def rms_to_db(self, rms: Number):
-        return 20 * np.log10(rms / 32768.0)
+        return vad.rms_to_db(rms)
 
     def get_db(self, audio_bytes: bytes):
         rms = self.get_rms(audio_bytes)
@@ -44,7 +98,54 @@ class AudioTools:
         
     @property
     def p(self):
-        return pyaudio.PyAudio()
+        return self.engine
+
+    def open_input_stream(self):
+        """Opens an always running microphone stream that feeds the
+        pre-roll ring buffer and any capture in progress"""
+        stream = self.p.open(
+            format=self.format,
+            channels=self.channels,
+            rate=self.sample_rate,
+            frames_per_buffer=self.chunk,
+            input=True,
+            stream_callback=self._on_audio,
+        )
+        stream.start_stream()
+        return stream
+
+    def _on_audio(
+        self, in_data: bytes, frame_count: int, time_info: dict, status: int
+    ) -> tuple:
+        self._ring.append(in_data)
+        if (capture := self._capture) is not None:
+            capture.put(in_data)
+        return None, pyaudio.paContinue
+
+    def start_capture(self, preroll: list[bytes]) -> Queue:
+        """Starts collecting microphone chunks, beginning with the `preroll`"""
+        capture = Queue()
+        for chunk in preroll:
+            capture.put(chunk)
+        self._capture = capture
+        return capture
+
+    def stop_capture(self, capture: Queue) -> bytes:
+        """Stops collecting microphone chunks and returns the ones not yet read"""
+        self._capture = None
+        remaining = bytearray()
+        while True:
+            try:
+                remaining.extend(capture.get_nowait())
+            except Empty:
+                return bytes(remaining)
+
+    def close(self) -> None:
+        """Releases the microphone stream, the player and the audio engine"""
+        self.input_stream.stop_stream()
+        self.input_stream.close()
+        self.player.close()
+        self.engine.terminate()
 
     def write_audio(
         self, audio_bytes: bytes, channels: int, sample_rate: int, sample_width: int
@@ -58,42 +159,93 @@ class AudioTools:
             wf.writeframes(audio_bytes)
         return output_file
 
+    def to_wav(self, audio_bytes: bytes, sample_width: int) -> BytesIO:
+        """Wraps raw recorded frames in an in-memory wav file"""
+        buffer = BytesIO()
+        with wave.open(buffer, "wb") as wf:
+            wf.setnchannels(self.channels)
+            wf.setframerate(self.sample_rate)
+            wf.setsampwidth(sample_width)
+            wf.writeframes(audio_bytes)
+        buffer.name = self.output_file  # the api infers the format from the name
+        buffer.seek(0)
+        return buffer
+
+    @property
+    def transcript(self) -> str | None:
+        """The stitched transcript of the last recording, if it was
+        transcribed while recording"""
+        if self.transcriber and self.transcriber.segments:
+            return self.transcriber.result()
+
     def record_and_write(self, button: Button) -> str:
         """Records from microphone while the button is held down,
         returns a resulting output audio file"""
         # self.led.on()
-        self.audio_playback(self.wake_signal)
+        # a new press cuts off whatever response is still playing
+        self.player.interrupt()
+        # the pre-roll is what was heard before the press, not the wake signal
+        preroll = list(self._ring)
+        self.audio_playback(self.wake_signal, priority=AudioPlayer.URGENT).wait()
+        capture = self.start_capture(preroll)
 
         channels, sample_rate = (
             self.channels,
             self.sample_rate,
         )
-        format, p, chunk = self.format, self.p, self.chunk
-        stream = p.open(
-            format=self.format,
-            channels=self.channels,
-            rate=sample_rate,
-            frames_per_buffer=self.chunk,
-            input=True,
-        )
+        chunk, sample_width = self.chunk, self.sample_width
+        detector = self.vad
+        detector.reset()
         audio_bytes = bytearray()
         record_step = sample_rate // chunk
-        while is_pressed := button.value:
+        transcriber = self.transcriber
+        if transcriber:
+            transcriber.reset()
+            frame_bytes = sample_width * channels
+            segment_bytes = int(self.segment_seconds * sample_rate) * frame_bytes
+            overlap_bytes = int(self.overlap_seconds * sample_rate) * frame_bytes
+            segment_start = 0
+        # stop when the button is released, or once the speaker goes quiet
+        while button.value and not detector.should_stop:
+            step_start = len(audio_bytes)
             for _ in range(record_step):
-                audio_bytes.extend(stream.read(chunk))
-        stream.stop_stream()
-        stream.close()
+                audio_bytes.extend(capture.get())
+            detector.update(audio_bytes[step_start:])
+            if transcriber and len(audio_bytes) - segment_start >= segment_bytes:
+                segment_end = len(audio_bytes)
+                segment = audio_bytes[segment_start:segment_end]
+                if not detector.is_silent(segment):
+                    transcriber.submit(self.to_wav(segment, sample_width))
+                segment_start = segment_end - overlap_bytes
+        audio_bytes.extend(self.stop_capture(capture))
+        if transcriber and len(audio_bytes) - segment_start > overlap_bytes:
+            segment = audio_bytes[segment_start:]
+            if not detector.is_silent(segment):
+                transcriber.submit(self.to_wav(segment, sample_width))
         # self.led.off()
-        p.terminate()
-        self.write_audio(
-            audio_bytes=bytes(audio_bytes),
-            channels=channels,
-            sample_rate=sample_rate,
-            sample_width=p.get_sample_size(format),
-        )
+        # recordings of dead air never reach the model
+        audio_bytes = detector.trim(bytes(audio_bytes))
+        self.has_speech = bool(audio_bytes)
+        if not audio_bytes:
+            return
+        # the recording stays in memory, it's only written out when debugging
+        self.recording = self.to_wav(audio_bytes, sample_width)
+        if self.debug_audio_files:
+            self.write_audio(
+                audio_bytes=audio_bytes,
+                channels=channels,
+                sample_rate=sample_rate,
+                sample_width=sample_width,
+            )
 
-    def audio_playback(self, audio_file):
-        subprocess.Popen(["mpg123", audio_file]).wait()
+    def audio_playback(self, audio: str | bytes, priority: int = AudioPlayer.NORMAL):
+        """Queues an mp3 file, PCM or synthesized audio for playback
+        and returns an event that is set once it has played"""
+        if isinstance(audio, str):
+            audio = self.player.load(audio)
+        elif self.tts_format != "pcm":
+            audio = self.player.decode(audio)
+        return self.player.play(audio, priority=priority)
         
 #using a buffer, it's slower though?   
 
@@ -0,0 +1,90 @@
+import subprocess
+import itertools
+import pyaudio
+from threading import Thread, Event
+from queue import PriorityQueue
+
+
+class AudioPlayer:
+    """Plays queued 16 bit mono PCM clips back to back on one long lived
+    output stream, so clips don't pay for spawning a player and
+    starting a decoder.
+
+    Clips with a lower priority value are played first. `interrupt`
+    drops everything queued and cuts off the clip that is playing.
+    """
+
+    URGENT, NORMAL = 0, 1
+
+    __slots__ = (
+        "stream",
+        "sample_rate",
+        "frames_per_write",
+        "clips",
+        "generation",
+        "decoded",
+        "worker",
+        "_order",
+    )
+
+    def __init__(
+        self, engine: pyaudio.PyAudio, sample_rate: int, frames_per_write: int = 1024
+    ):
+        self.sample_rate = sample_rate
+        self.frames_per_write = frames_per_write
+        self.stream = engine.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=sample_rate,
+            frames_per_buffer=frames_per_write,
+            output=True,
+        )
+        self.clips = PriorityQueue()
+        self.generation = 0
+        self.decoded = {}
+        self._order = itertools.count()  # keeps clips of equal priority in order
+        self.worker = Thread(target=self._play_clips, daemon=True)
+        self.worker.start()
+
+    def decode(self, audio: str | bytes) -> bytes:
+        """Decodes an mp3 file, or encoded mp3 bytes, to PCM at the player's rate"""
+        source, data = (audio, None) if isinstance(audio, str) else ("-", audio)
+        rate = str(self.sample_rate)
+        return subprocess.run(
+            ["mpg123", "-q", "-s", "-m", "-e", "s16", "-r", rate, source],
+            input=data,
+            capture_output=True,
+            check=True,
+        ).stdout
+
+    def load(self, audio_file: str) -> bytes:
+        """Decodes an audio file once and keeps its PCM for later"""
+        if audio_file not in self.decoded:
+            self.decoded[audio_file] = self.decode(audio_file)
+        return self.decoded[audio_file]
+
+    def play(self, pcm: bytes, priority: int = NORMAL) -> Event:
+        """Queues a clip, returning an event that is set once it's done playing"""
+        done = Event()
+        self.clips.put((priority, next(self._order), self.generation, pcm, done))
+        return done
+
+    def interrupt(self) -> None:
+        """Stops the current clip and drops every clip queued before now"""
+        self.generation += 1
+
+    def _play_clips(self) -> None:
+        stream, step = self.stream, self.frames_per_write * 2  # int16 mono
+        while True:
+            *_, generation, pcm, done = self.clips.get()
+            view = memoryview(pcm)
+            for start in range(0, len(view), step):
+                if generation != self.generation:
+                    break
+                stream.write(view[start:start + step].tobytes())
+            done.set()
+
+    def close(self) -> None:
+        self.interrupt()
+        self.stream.stop_stream()
+        self.stream.close()
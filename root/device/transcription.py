@@ -0,0 +1,59 @@
+import re
+from io import BytesIO
+from typing import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+def normalize_word(word: str) -> str:
+    return re.sub(r"[^\w']", "", word.lower())
+
+
+def stitch_transcripts(transcripts: list[str], max_overlap: int = 8) -> str:
+    """Joins the transcripts of overlapping audio segments, dropping the words
+    each segment repeats from the end of the one before it
+
+    Args:
+        transcripts: the transcript of every segment, in recording order
+        max_overlap: the most words two neighbouring segments can share
+    """
+    words = []
+    for transcript in transcripts:
+        new_words = transcript.split()
+        normalized = [normalize_word(w) for w in new_words]
+        tail = [normalize_word(w) for w in words[-max_overlap:]]
+        overlap = next(
+            (
+                size
+                for size in range(min(len(tail), len(normalized)), 0, -1)
+                if tail[-size:] == normalized[:size]
+            ),
+            0,
+        )
+        words.extend(new_words[overlap:])
+    return " ".join(words)
+
+
+class IncrementalTranscriber:
+    """Transcribes segments of a recording in the background while it is
+    still being recorded, so the full transcript is ready soon after
+    the recording stops
+    """
+
+    __slots__ = ("transcribe", "pool", "segments")
+
+    def __init__(self, transcribe: Callable[[BytesIO], str], max_workers: int = 2):
+        self.transcribe = transcribe
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.segments: list[Future] = []
+
+    def reset(self) -> None:
+        """Forgets the segments of the previous recording"""
+        self.segments = []
+
+    def submit(self, segment: BytesIO) -> None:
+        """Starts transcribing a segment of the current recording"""
+        self.segments.append(self.pool.submit(self.transcribe, segment))
+
+    def result(self) -> str:
+        """Waits for every submitted segment and returns the stitched transcript"""
+        return stitch_transcripts([segment.result() for segment in self.segments])
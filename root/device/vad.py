@@ -0,0 +1,95 @@
+import numpy as np
+from numbers import Number
+
+
+def get_rms(audio: np.ndarray, axis: int | None = None) -> np.ndarray | Number:
+    """Root mean square of int16 samples, optionally along an axis of frames"""
+    audio = audio.astype(np.float32)
+    return np.sqrt(np.mean(np.square(audio), axis=axis))
+
+
+def rms_to_db(rms: np.ndarray | Number) -> np.ndarray | Number:
+    # floor the rms so digital silence maps to a very low level instead of -inf
+    return 20 * np.log10(np.maximum(rms, 1e-6) / 32768.0)
+
+
+class VoiceActivityDetector:
+    """Frame level voice activity detection for int16 recordings.
+
+    Audio is split into short frames and every frame louder than
+    `threshold_db` counts as speech. All frames of a block are measured
+    at once, so it's cheap enough to run on every captured block.
+    """
+
+    __slots__ = (
+        "threshold_db",
+        "frame_length",
+        "frame_seconds",
+        "padding_frames",
+        "auto_stop_seconds",
+        "heard_speech",
+        "trailing_silence",
+    )
+
+    def __init__(
+        self,
+        sample_rate: int,
+        channels: int,
+        threshold_db: Number,
+        frame_seconds: Number = 0.02,
+        padding_seconds: Number = 0.2,
+        auto_stop_seconds: Number | None = None,
+    ):
+        self.threshold_db = threshold_db
+        self.frame_seconds = frame_seconds
+        # in samples, interleaved channels are measured together
+        self.frame_length = max(int(sample_rate * frame_seconds), 1) * channels
+        self.padding_frames = int(padding_seconds / frame_seconds)
+        self.auto_stop_seconds = auto_stop_seconds
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the state of the previous recording"""
+        self.heard_speech = False
+        self.trailing_silence = 0.0
+
+    def speech_frames(self, audio_bytes: bytes) -> np.ndarray:
+        """A boolean per full frame of `audio_bytes`, True where it is speech"""
+        samples = np.frombuffer(audio_bytes, dtype=np.int16)
+        frame_length = self.frame_length
+        n_frames = len(samples) // frame_length
+        frames = samples[: n_frames * frame_length].reshape(n_frames, frame_length)
+        return rms_to_db(get_rms(frames, axis=1)) > self.threshold_db
+
+    def update(self, audio_bytes: bytes) -> None:
+        """Tracks speech and trailing silence with a newly captured block"""
+        speech = self.speech_frames(audio_bytes)
+        if speech.any():
+            self.heard_speech = True
+            last_speech = np.flatnonzero(speech)[-1]
+            self.trailing_silence = (len(speech) - last_speech - 1) * self.frame_seconds
+        else:
+            self.trailing_silence += len(speech) * self.frame_seconds
+
+    @property
+    def should_stop(self) -> bool:
+        """Whether the speaker has been quiet for long enough to stop recording"""
+        return (
+            self.auto_stop_seconds is not None
+            and self.heard_speech
+            and self.trailing_silence >= self.auto_stop_seconds
+        )
+
+    def is_silent(self, audio_bytes: bytes) -> bool:
+        return not self.speech_frames(audio_bytes).any()
+
+    def trim(self, audio_bytes: bytes) -> bytes:
+        """Trims leading and trailing silence, keeping a little padding around
+        the speech. Returns empty bytes if there is no speech at all"""
+        speech = np.flatnonzero(self.speech_frames(audio_bytes))
+        if not len(speech):
+            return b""
+        frame_bytes = self.frame_length * 2  # int16
+        start = max(speech[0] - self.padding_frames, 0) * frame_bytes
+        end = (speech[-1] + 1 + self.padding_frames) * frame_bytes
+        return audio_bytes[start:end]
@@ -0,0 +1,82 @@
+import csv
+import numpy as np
+from pathlib import Path
+from numbers import Number
+
+
+class CPITable:
+    """Average consumer price indexes keyed by `(region_code, year)`.
+
+    Lookups go through plain dictionaries of row and column positions,
+    and many lookups at once are a single fancy index into the matrix.
+    The table is parsed from csv once and then kept as an `.npz` file,
+    which loads much faster.
+    """
+
+    __slots__ = ("rows", "columns", "cpis", "current_year")
+
+    def __init__(self, regions: np.ndarray, years: np.ndarray, cpis: np.ndarray):
+        self.rows = {str(region): row for row, region in enumerate(regions)}
+        self.columns = {int(year): column for column, year in enumerate(years)}
+        self.cpis = cpis
+        # the newest year in the data, prices are adjusted to it
+        # TODO: automate updating the inflation data
+        self.current_year = int(max(years))
+
+    @classmethod
+    def from_csv(cls, csv_file: str | Path) -> "CPITable":
+        with open(csv_file, newline="") as f:
+            reader = csv.DictReader(f)
+            years = [field for field in reader.fieldnames if field.isdigit()]
+            regions, cpis = [], []
+            for row in reader:
+                regions.append(row["region_code"])
+                cpis.append([float(row[year] or "nan") for year in years])
+        return cls(
+            regions=np.array(regions),
+            years=np.array(years, dtype=np.int64),
+            cpis=np.array(cpis, dtype=np.float64),
+        )
+
+    @classmethod
+    def load(cls, csv_file: str | Path, cache_file: str | Path) -> "CPITable":
+        """Loads the binary table, rebuilding it if the csv is newer"""
+        csv_file, cache_file = Path(csv_file), Path(cache_file)
+        if cache_file.exists() and (
+            not csv_file.exists()
+            or cache_file.stat().st_mtime >= csv_file.stat().st_mtime
+        ):
+            with np.load(cache_file) as data:
+                return cls(
+                    regions=data["regions"], years=data["years"], cpis=data["cpis"]
+                )
+        table = cls.from_csv(csv_file)
+        table.save(cache_file)
+        return table
+
+    def save(self, cache_file: str | Path) -> None:
+        with open(cache_file, "wb") as f:
+            np.savez(
+                f,
+                regions=np.array(list(self.rows)),
+                years=np.array(list(self.columns), dtype=np.int64),
+                cpis=self.cpis,
+            )
+
+    def __getitem__(self, key: tuple[str, int]) -> float:
+        region, year = key
+        return self.cpis[self.rows[region], self.columns[int(year)]]
+
+    def inflation(self, value: Number, region: str, year: int) -> Number:
+        """Adjusts a value from `year` prices to the most recent year's"""
+        return value * (self[region, year] / self[region, self.current_year])
+
+    def inflation_many(
+        self, values: np.ndarray, regions: list[str], years: list[int]
+    ) -> np.ndarray:
+        """`inflation` for many values at once"""
+        rows = np.fromiter((self.rows[r] for r in regions), dtype=np.intp)
+        columns = np.fromiter((self.columns[int(y)] for y in years), dtype=np.intp)
+        old_cpis = self.cpis[rows, columns]
+        current_cpis = self.cpis[rows, self.columns[self.current_year]]
+        return np.asarray(values, dtype=np.float64) * (old_cpis / current_cpis)
@@ -1,36 +1,114 @@
 from numbers import Number
 import os, logging, requests
+import httpx
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from config import Config
-import pandas as pd
+from root.cache import PersistentCache
+from root.impacts.cpi import CPITable
 
 
 class GHGCalculator:
     __slots__ = (
         "region",
         "estimation_endpoint",
+        "batch_endpoint",
         "search_endpoint",
         "ghgs",
         "emission_factors",
         "currency",
         "api_auth",
-        "consumer_price_index",
-        "version"
+        "cpi_files",
+        "_consumer_price_index",
+        "version",
+        "query_cache",
+        "session",
+        "timeout",
+        "pool_size",
+        "retries",
+        "_async_client",
+        "batch_size",
     )
 
     def __init__(self, region: str, currency: str):
         url = "https://beta4.api.climatiq.io"
         self.estimation_endpoint = f"{url}/estimate"
+        self.batch_endpoint = f"{url}/batch"
         self.search_endpoint = f"{url}/search"
         api_key = os.environ.get("CALCULATIONS_API_KEY")
         self.api_auth = {"Authorization": f"Bearer: {api_key}"}
         config = Config()
+        # keep-alive connections, so only the first request pays for tcp + tls
+        self.timeout = (config.http_connect_timeout, config.http_read_timeout)
+        self.pool_size = config.http_pool_size
+        self.retries = config.http_retries
+        self.session = self.make_session()
+        self._async_client = None
+        self.batch_size = 100  # the most estimates the batch endpoint takes
         self.ghgs = config.greenhouse_gasses
-        self.consumer_price_index = pd.read_csv(
-            str(config.data_dir / "average-cpis.csv")
+        # loaded on first use, it isn't needed until the first calculation
+        self.cpi_files = (
+            config.data_dir / "average-cpis.csv", config.data_dir / "average-cpis.npz"
         )
+        self._consumer_price_index = None
         self.currency = currency
         self.region = region
         self.version = config.api_data_version
+        # the best factor for an activity, version and region rarely changes
+        self.query_cache = PersistentCache(
+            path=config.query_cache_file,
+            maxsize=config.query_cache_size,
+            ttl=config.query_cache_ttl,
+        )
+
+    def make_session(self) -> requests.Session:
+        """A pooled session that retries connection errors and busy responses"""
+        retry = Retry(
+            total=self.retries,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=None,  # estimates are safe to repeat
+        )
+        adapter = HTTPAdapter(pool_maxsize=self.pool_size, max_retries=retry)
+        session = requests.Session()
+        session.headers.update(self.api_auth)
+        session.mount("https://", adapter)
+        return session
+
+    @property
+    def async_client(self) -> httpx.AsyncClient:
+        """A pooled async client for when several estimates are in flight"""
+        if self._async_client is None:
+            connect, read = self.timeout
+            pool_size = self.pool_size
+            self._async_client = httpx.AsyncClient(
+                headers=self.api_auth,
+                timeout=httpx.Timeout(read, connect=connect),
+                limits=httpx.Limits(
+                    max_connections=pool_size, max_keepalive_connections=pool_size
+                ),
+                # only retries failed connections, unlike the sync session
+                transport=httpx.AsyncHTTPTransport(retries=self.retries),
+            )
+        return self._async_client
+
+    def close(self) -> None:
+        self.session.close()
+        self.query_cache.close()
+
+    async def aclose(self) -> None:
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+    @property
+    def consumer_price_index(self) -> CPITable:
+        if self._consumer_price_index is None:
+            csv_file, cache_file = self.cpi_files
+            self._consumer_price_index = CPITable.load(
+                csv_file=csv_file, cache_file=cache_file
+            )
+        return self._consumer_price_index
 
     @property
     def unit_types_to_unit(self):
@@ -40,49 +118,84 @@ class GHGCalculator:
         }
 
     def calc_inflation(self, value, factor_region, factor_year):
-        cpis = self.consumer_price_index
-        region = cpis[cpis["region_code"] == factor_region]
-        old_cpi = next(iter(region.loc[:, str(factor_year)]))
-        current_cpi = next(
-            iter(
-                region.loc[
-                    :, str(2023)
-                ]  # TODO: only have inflation data to 2023, and how do we automate the updates of it?
-            )
+        return self.consumer_price_index.inflation(
+            value=value, region=factor_region, year=factor_year
+        )
+
+    def calc_inflation_many(self, values, factor_regions, factor_years):
+        """`calc_inflation` for many values at once"""
+        return self.consumer_price_index.inflation_many(
+            values=values, regions=factor_regions, years=factor_years
         )
-        real = value * (old_cpi / current_cpi)
-        return real
 
     def get_possible_queries(self, queries: dict) -> dict:
         """This endpoint returns the possibilites of stricter query combinations 
         (year, region, etc) given a set of query params already in place
         """
-        return requests.get(
-            url=self.search_endpoint, params=queries, headers=self.api_auth
+        return self.session.get(
+            url=self.search_endpoint, params=queries, timeout=self.timeout
         ).json()
 
-    def get_best_query(self, activity_id: str) -> int:
-        # TODO: consider either region fallback or year fallback parameter instead of this, especially if it's faster
-        """Logic to get the most recent year available for an emission factor
-        given the user's region. Falls back to latest year if the region
-        doesn't have a factor
-        """
+    async def aget_possible_queries(self, queries: dict) -> dict:
+        """Async version of `get_possible_queries`"""
+        response = await self.async_client.get(
+            url=self.search_endpoint, params=queries
+        )
+        return response.json()
 
-        queries = {
-            "activity_id": activity_id,
-            "data_version": self.version,
-            "region": self.region,
-        }
-        valid_queries = self.get_possible_queries(queries=queries)
-        if valid_queries["total_results"] < 1:
+    def factor_searches(self, activity_id: str) -> list[dict]:
+        """The searches for an activity's emission factors, in the user's
+        region first and then in any region"""
+        queries = {"activity_id": activity_id, "data_version": self.version}
+        return [{**queries, "region": self.region}, queries]
+
+    def pick_best_query(self, valid_queries: dict) -> dict | None:
+        """The most recent emission factor among the search results, if any"""
+        if valid_queries["total_results"] < 1 or not valid_queries["results"]:
+            return None
+        return max(valid_queries["results"], key=lambda x: x["year"])
+
+    def log_fallback(self, queries: dict) -> None:
+        if "region" in queries:
             logging.warning(
                 "No corresponding emission factor for the given region"
                 f" `{self.region}` falling back to latest year"
             )
-            queries.pop("region")
+
+    def get_best_query(self, activity_id: str) -> dict:
+        # TODO: consider either region fallback or year fallback parameter instead of this, especially if it's faster
+        """Logic to get the most recent year available for an emission factor
+        given the user's region. Falls back to latest year if the region
+        doesn't have a factor
+        """
+        cache_key = (activity_id, self.version, self.region)
+        if (best_match := self.query_cache.get(cache_key)) is not None:
+            return best_match
+        for queries in self.factor_searches(activity_id):
             valid_queries = self.get_possible_queries(queries=queries)
-        best_match = max(valid_queries["results"], key=lambda x: x["year"])
-        return best_match
+            if (best_match := self.pick_best_query(valid_queries)) is not None:
+                self.query_cache.set(cache_key, best_match)
+                return best_match
+            self.log_fallback(queries)
+        raise ValueError(f"No emission factor was found for `{activity_id}`")
+
+    async def aget_best_query(self, activity_id: str) -> dict:
+        """Async version of `get_best_query`, sharing its cache"""
+        cache_key = (activity_id, self.version, self.region)
+        if (best_match := self.query_cache.get(cache_key)) is not None:
+            return best_match
+        for queries in self.factor_searches(activity_id):
+            valid_queries = await self.aget_possible_queries(queries=queries)
+            if (best_match := self.pick_best_query(valid_queries)) is not None:
+                self.query_cache.set(cache_key, best_match)
+                return best_match
+            self.log_fallback(queries)
+        raise ValueError(f"No emission factor was found for `{activity_id}`")
+
+    @property
+    def cache_info(self) -> dict:
+        """Hits and misses of the best query cache"""
+        return self.query_cache.cache_info()
 
     def format_request(
         self, activity_id: str, value: Number, unit_type: str, unit: str
@@ -90,14 +203,38 @@ class GHGCalculator:
         """Get a request ready for the emissions estimation endpoint"""
 
         best_match = self.get_best_query(activity_id=activity_id)
+        return self.make_request(
+            best_match=best_match, value=value, unit_type=unit_type, unit=unit
+        )
+
+    async def aformat_request(
+        self, activity_id: str, value: Number, unit_type: str, unit: str
+    ) -> dict:
+        """Async version of `format_request`"""
+        best_match = await self.aget_best_query(activity_id=activity_id)
+        return self.make_request(
+            best_match=best_match, value=value, unit_type=unit_type, unit=unit
+        )
+
+    def make_request(
+        self, best_match: dict, value: Number, unit_type: str, unit: str
+    ) -> dict:
+        """Builds an estimation request for the given emission factor"""
         # account inflation w.r.t the emission factor's region and year
         real_value = self.calc_inflation(
             value=value,
             factor_region=best_match["region"],
             factor_year=best_match["year"],
         )
+        return self.estimate_request(
+            best_match=best_match, real_value=real_value, unit_type=unit_type, unit=unit
+        )
 
-        parameters = {unit_type: real_value, f"{unit_type}_unit": unit}
+    def estimate_request(
+        self, best_match: dict, real_value: Number, unit_type: str, unit: str
+    ) -> dict:
+        """Builds an estimation request from a value already adjusted for inflation"""
+        parameters = {unit_type: float(real_value), f"{unit_type}_unit": unit}
         data = {
             "emission_factor": {
                 "id": best_match["id"],
@@ -147,18 +284,98 @@ class GHGCalculator:
 
         Returns: The given emissions for the ghgs with available factors
         """
-        # unit = unit or self.unit_types_to_unit[unit_type]
-        # request = self.format_request(
-        #     activity_id=activity_id, value=value, unit=unit, unit_type=unit_type
-        # )
-        # res = requests.post(
-        #     url=self.estimation_endpoint, headers=self.api_auth, json=request
-        # )
-        # return self.format_response(res.json())
-        import random
-        return {
-            "co2e": random.randint(0, value * 1.5),
-            "ch4": None,
-            "co2": None,
-            "n2o": None
-        }
+        unit = unit or self.unit_types_to_unit[unit_type]
+        request = self.format_request(
+            activity_id=activity_id, value=value, unit=unit, unit_type=unit_type
+        )
+        res = self.session.post(
+            url=self.estimation_endpoint, json=request, timeout=self.timeout
+        )
+        return self.format_response(res.json())
+
+    def batch(self, estimates: list[dict]) -> list[dict]:
+        """Estimates many activities with one request to the batch endpoint.
+        The best query of each distinct activity is only resolved once
+
+        Args:
+            estimates: dictionaries of the keyword arguments to `__call__`
+
+        Returns: the emissions of each estimate in order, or a dictionary
+        with an `error` for the ones that failed
+        """
+        best_matches = {}
+        for activity_id in dict.fromkeys(e["activity_id"] for e in estimates):
+            try:
+                best_matches[activity_id] = self.get_best_query(activity_id=activity_id)
+            except (ValueError, KeyError, requests.RequestException) as e:
+                best_matches[activity_id] = {"error": f"{type(e).__name__}: {e}"}
+        results = [best_matches[e["activity_id"]] for e in estimates]
+        # estimates whose factor wasn't found keep the error in their place
+        found = [i for i, r in enumerate(results) if "error" not in r]
+        real_values = self.inflation_or_errors(
+            values=[estimates[i]["value"] for i in found],
+            factors=[results[i] for i in found],
+        )
+        batch_requests = {}
+        for i, real_value in zip(found, real_values):
+            if isinstance(real_value, dict):
+                results[i] = real_value
+                continue
+            e = estimates[i]
+            batch_requests[i] = self.estimate_request(
+                best_match=results[i],
+                real_value=real_value,
+                unit_type=e["unit_type"],
+                unit=e.get("unit") or self.unit_types_to_unit[e["unit_type"]],
+            )
+        positions, batch_requests = list(batch_requests), list(batch_requests.values())
+        estimated = []
+        for start in range(0, len(batch_requests), self.batch_size):
+            res = self.session.post(
+                url=self.batch_endpoint,
+                json=batch_requests[start:start + self.batch_size],
+                timeout=self.timeout,
+            )
+            estimated.extend(res.json()["results"])
+        for i, r in zip(positions, estimated):
+            results[i] = {"error": r["message"]} if "error" in r else self.format_response(r)
+        return results
+
+    def inflation_or_errors(self, values: list, factors: list[dict]) -> list:
+        """`calc_inflation_many`, going one value at a time when a factor's
+        region or year has no consumer price index, to find which ones
+
+        Returns: each value adjusted for inflation, or a dictionary with an
+        `error` in its place
+        """
+        try:
+            return list(self.calc_inflation_many(
+                values=values,
+                factor_regions=[f["region"] for f in factors],
+                factor_years=[f["year"] for f in factors],
+            ))
+        except KeyError:
+            pass
+        real_values = []
+        for value, factor in zip(values, factors):
+            try:
+                real_values.append(self.calc_inflation(
+                    value=value, factor_region=factor["region"], factor_year=factor["year"]
+                ))
+            except KeyError:
+                real_values.append({"error": (
+                    f"No consumer price index for `{factor['region']}` "
+                    f"in {factor['year']}"
+                )})
+        return real_values
+
+    async def acall(
+        self, value: Number, activity_id: str, unit_type: str, unit: str | None = None
+    ) -> dict:
+        """Async version of `__call__`, so several estimates can be in flight"""
+        unit = unit or self.unit_types_to_unit[unit_type]
+        request = await self.aformat_request(
+            activity_id=activity_id, value=value, unit=unit, unit_type=unit_type
+        )
+        res = await self.async_client.post(url=self.estimation_endpoint, json=request)
+        return self.format_response(res.json())
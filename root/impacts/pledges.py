@@ -1,151 +1,213 @@
+import heapq
+import logging
+import itertools
+from datetime import timedelta, datetime, timezone
+from threading import Thread, Condition
+from pymongo import UpdateOne
+from pymongo.collection import Collection
 
+# months and years are kept as fixed lengths so every period is the same
+PLEDGE_FREQUENCIES = {
+    "day": timedelta(days=1),
+    "week": timedelta(weeks=1),
+    "month": timedelta(days=30),
+    "year": timedelta(days=365),
+}
 
-from datetime import timedelta, datetime, timezone
-from numbers import Number
-from multiprocessing import Process
-import time, math
-import pymongo
-
-
-class PledgeKeeper:
-    __slots__ = (
-        "pledge", "pledges", "pledge_name", "caught_up"
-        )
-    
-    def __init__(self, pledge_name: str):
-        self.pledge_name = pledge_name
-        self.caught_up = False
-    
-    def init_pledge(self):
-        pledges = pymongo.MongoClient().edge.pledges
-        pledge = pledges.find_one({"pledge_name": self.pledge_name})
-        self.pledge = pledge
+
+def pledge_period(pledge_frequency: str | dict) -> timedelta:
+    """How long one period of a pledge lasts
+
+    Args:
+        pledge_frequency: one of "day", "week", "month" or "year", or the
+        keyword arguments to a timedelta
+    """
+    if isinstance(pledge_frequency, dict):
+        return timedelta(**pledge_frequency)
+    return PLEDGE_FREQUENCIES[pledge_frequency]
+
+
+def periods_passed(last_updated: datetime, period: timedelta, now: datetime) -> int:
+    """How many whole periods of a pledge have passed since it was last updated"""
+    return max((now - last_updated) // period, 0)
+
+
+def period_expression(pledge_frequency: str = "$pledge_frequency") -> dict:
+    """Aggregation expression for the length of a pledge's period,
+    in milliseconds, like `pledge_period`"""
+    milliseconds = timedelta(milliseconds=1)
+    units = ("weeks", "days", "hours", "minutes", "seconds")
+    return {
+        "$switch": {
+            "branches": [
+                {
+                    "case": {"$eq": [pledge_frequency, name]},
+                    "then": period // milliseconds,
+                }
+                for name, period in PLEDGE_FREQUENCIES.items()
+            ],
+            # a timedelta's keyword arguments
+            "default": {
+                "$add": [
+                    {
+                        "$multiply": [
+                            {"$ifNull": [f"{pledge_frequency}.{unit}", 0]},
+                            timedelta(**{unit: 1}) // milliseconds,
+                        ]
+                    }
+                    for unit in units
+                ]
+            },
+        }
+    }
+
+
+def accrual_stages(now: datetime) -> list:
+    """Stages crediting each pledge for the periods that passed since it
+    was last updated, as of `now`, without writing them. `last_updated`
+    is moved to the end of the last credited period"""
+    period = period_expression()
+    return [
+        {
+            "$set": {
+                "periods_due": {
+                    "$max": [
+                        {
+                            "$floor": {
+                                "$divide": [
+                                    {"$subtract": [now, "$last_updated"]}, period
+                                ]
+                            }
+                        },
+                        0,
+                    ]
+                }
+            }
+        },
+        {
+            "$set": {
+                "impact": {
+                    "$add": [
+                        "$impact", {"$multiply": ["$periods_due", "$co2e_factor"]}
+                    ]
+                },
+                "pledge_streak": {"$add": ["$pledge_streak", "$periods_due"]},
+                "last_updated": {
+                    "$add": ["$last_updated", {"$multiply": ["$periods_due", period]}]
+                },
+            }
+        },
+        {"$unset": "periods_due"},
+    ]
+
+
+def checkpoint_pledges(pledges: Collection, filter: dict) -> None:
+    """Writes the impact pledges accrued so far, so later reads have fewer
+    periods to credit"""
+    pledges.update_many(filter, accrual_stages(datetime.now(tz=timezone.utc)))
+
+
+class PledgeScheduler:
+    """Keeps every pledge up to date from a single thread. Pledges wait in a
+    heap ordered by when their next period ends, and all the pledges due
+    together are updated with one bulk write
+    """
+
+    __slots__ = ("pledges", "heap", "counter", "condition", "batch_window", "thread")
+
+    def __init__(self, pledges: Collection, batch_window: float = 1):
+        """
+        Args:
+            pledges: the pledges collection
+            batch_window: seconds to wait for other pledges coming due, so
+            they are written together
+        """
         self.pledges = pledges
-        freq = timedelta(**pledge["pledge_frequency"])
-        pledge_frequency = freq.total_seconds()
-        return pledge["last_updated"], pledge_frequency
-        
-        
-    def update_pledge(self) -> dict:
-        """Update's a pledge in the db"""
-        pledge = self.pledge
-        pledge_name = pledge["pledge_name"]
-        updated_impact = pledge["impact"] + pledge["co2e_factor"]
-        updated_streak = pledge["pledge_streak"] + 1
-        now = datetime.now(tz=timezone.utc)
-        update = {
-            "impact": updated_impact,
-            "pledge_streak": updated_streak,
-            "last_updated": now
+        self.heap = []
+        # breaks ties between pledges due at the same time
+        self.counter = itertools.count()
+        self.condition = Condition()
+        self.batch_window = timedelta(seconds=batch_window)
+        self.thread = None
+
+    def add(self, pledge: dict) -> None:
+        """Schedules a pledge's next update"""
+        entry = {
+            "_id": pledge["_id"],
+            "co2e_factor": pledge["co2e_factor"],
+            "period": pledge_period(pledge["pledge_frequency"]),
+            "last_updated": pledge["last_updated"].replace(tzinfo=timezone.utc),
         }
-        self.pledges.update_one({"pledge_name": pledge_name}, {"$set": update})
-        self.pledge = {**pledge, **update}
-        if self.caught_up: self._keep_pledge()
-    
-    @staticmethod
-    def seconds_diff(last_updated: datetime):
-        """Seconds difference since last updated"""
-        return (datetime.now(tz=timezone.utc) - last_updated).total_seconds()
-    
-    #NOTE: maybe this is overdoing it? accounting for even the days they have not powered on
-    def check_lag(self, last_updated: datetime, pledge_frequency: Number):
-        """Account for the passed pledge frequencies which did not get updated"""
-        waited = self.seconds_diff(last_updated) 
-        seconds, lagged = math.modf(waited / pledge_frequency)
-        for _ in range(int(lagged)):
-            print("catching up", _)
-            self.update_pledge()
-        remainder = pledge_frequency - (pledge_frequency * seconds)
-        print("now remainder", remainder)
-        self.caught_up = True
-        time.sleep(remainder)
-        self.update_pledge()
-    
-    def _keep_pledge(self):
-        """A loop that simply sleeps until a pledge should be updated.
-        There is a one second delay to avoid troublesome comparisons"""
-        last_updated, pledge_frequency = self.init_pledge()
-        if not self.caught_up: 
-            self.check_lag(
-                last_updated=last_updated, pledge_frequency=pledge_frequency
+        with self.condition:
+            self.push(entry)
+            self.condition.notify()
+
+    def push(self, entry: dict) -> None:
+        due = entry["last_updated"] + entry["period"]
+        heapq.heappush(self.heap, (due, next(self.counter), entry))
+
+    def load(self, filter: dict | None = None) -> None:
+        """Schedules every pledge in the collection matching `filter`, and
+        catches up the ones that lagged while the device was off with
+        a single write"""
+        for pledge in self.pledges.find(
+            filter or {},
+            {"co2e_factor": 1, "pledge_frequency": 1, "last_updated": 1},
+        ):
+            self.add(pledge)
+        with self.condition:
+            updates = self.pop_due(datetime.now(tz=timezone.utc))
+        if updates:
+            self.pledges.bulk_write(updates, ordered=False)
+
+    def pop_due(self, now: datetime) -> list[UpdateOne]:
+        """Takes every pledge due by `now` off the heap, rescheduling each for
+        its next period, and returns their updates. A pledge that missed
+        several periods is credited for all of them in one update"""
+        updates = []
+        while self.heap and self.heap[0][0] <= now:
+            _, _, entry = heapq.heappop(self.heap)
+            period, since = entry["period"], entry["last_updated"]
+            periods = periods_passed(since, period, now)
+            last_updated = since + periods * period
+            updates.append(
+                # matched on the period it was scheduled from, so it's credited once
+                UpdateOne(
+                    {"_id": entry["_id"], "last_updated": since},
+                    {
+                        "$inc": {
+                            "impact": periods * entry["co2e_factor"],
+                            "pledge_streak": periods,
+                        },
+                        "$set": {"last_updated": last_updated},
+                    },
+                )
             )
-        print("ok caught up now")
-        while (wait := self.seconds_diff(last_updated)) < pledge_frequency:
-            wait_time = pledge_frequency - wait
-            print("waiting", wait_time)
-            time.sleep(wait_time + 1.3)
-        print("updating")
-        self.update_pledge()
-        
-    def keep_pledge(self):
-        """Monitor a pledge and keep updating it as a 
-        non blocking task."""
-        process = Process(
-            target=self._keep_pledge, daemon=True
-        )
-        process.start()
-
-# import time, math
-# from numbers import Number
-# class PledgeKeeper:
-#     __slots__ = (
-#         "pledge", "pledges", "pledge_frequency", "pledge_name", "caught_up"
-#     )
-    
-#     def __init__(self, pledge_name: str):
-#         self.pledge_name = pledge_name
-#         self.caught_up = False
-    
-#     def init_pledge(self):
-#         pledges = pymongo.MongoClient().edge.pledges
-#         pledge = pledges.find_one({"pledge_name": self.pledge_name})
-#         self.pledge = pledge
-#         self.pledges = pledges
-#         last_updated = pledge["last_updated"]
-#         since_last = (datetime.now() - last_updated).total_seconds()
-#         freq = timedelta(**pledge["pledge_frequency"])
-#         self.pledge_frequency = freq
-#         self.check_lag(
-#             since_last=since_last, pledge_frequency=freq.total_seconds()
-#         )
-        
-        
-#     def update_pledge(self) -> dict:
-#         pledge = self.pledge
-#         pledge_name, last_updated = pledge["pledge_name"], pledge["last_updated"]
-#         updated_impact = pledge["impact"] + pledge["co2e_factor"]
-#         updated_streak = pledge["pledge_streak"] + 1
-#         now = datetime.now()
-#         update = {
-#             "impact": updated_impact,
-#             "pledge_streak": updated_streak,
-#             "last_updated": now,
-#         }
-#         self.pledges.update_one({"pledge_name": pledge_name}, {"$set": update})
-#         self.pledge = {**pledge, **update}
-#         next_update = now + self.pledge_frequency
-        
-#         if self.caught_up: self._keep_pledge(next_update=next_update)
-    
-#     def check_lag(self, since_last, pledge_frequency):
-#         lag = since_last / pledge_frequency
-#         seconds, lagged = math.modf(lag)
-#         print(lag)
-#         for _ in range(int(lagged)):
-#             print("cathing up", _)
-#             self.update_pledge()
-#         remainder = pledge_frequency - (seconds * pledge_frequency)
-#         print("remainder now", remainder)
-#         time.sleep(remainder)
-#         print("waited now caught up")
-#         self.caught_up = True
-#         self.update_pledge()
-        
-#     def _keep_pledge(self, next_update: Number | None = None):
-#         if not self.caught_up: self.init_pledge()
-#         while (wait_time := (next_update - datetime.now()).total_seconds()) > 0:
-#             print("waiting", wait_time)
-#             time.sleep(wait_time + 1.3)
-#         print("updating")
-#         self.update_pledge()
-    
+            entry["last_updated"] = last_updated
+            self.push(entry)
+        return updates
+
+    def run(self) -> None:
+        """Sleeps until the next pledge is due and updates every due pledge"""
+        condition = self.condition
+        while True:
+            with condition:
+                now = datetime.now(tz=timezone.utc)
+                while not self.heap or self.heap[0][0] > now:
+                    # woken early when a pledge is added
+                    timeout = (
+                        (self.heap[0][0] - now).total_seconds() if self.heap else None
+                    )
+                    condition.wait(timeout)
+                    now = datetime.now(tz=timezone.utc)
+                updates = self.pop_due(now + self.batch_window)
+            try:
+                self.pledges.bulk_write(updates, ordered=False)
+            except Exception as e:
+                logging.warning(f"Failed to update {len(updates)} pledges: {e!r}")
+
+    def start(self) -> None:
+        """Runs the scheduler in a background thread"""
+        if self.thread is None:
+            self.thread = Thread(target=self.run, name="pledges", daemon=True)
+            self.thread.start()
@@ -0,0 +1,96 @@
+import logging
+from datetime import datetime, timezone
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+INDEXES = {
+    "logs": [
+        # period totals and time ranges
+        IndexModel([("savior_id", ASCENDING), ("created", DESCENDING)]),
+        # emitting activities, covers the fields it groups and sums
+        IndexModel(
+            [("savior_id", ASCENDING), ("activity", ASCENDING), ("co2e", ASCENDING)]
+        ),
+    ],
+    "log_rollups": [
+        IndexModel([("savior_id", ASCENDING), ("day", DESCENDING)]),
+        IndexModel([("savior_id", ASCENDING), ("activity", ASCENDING)]),
+    ],
+    "pledges": [
+        IndexModel([("savior_id", ASCENDING), ("pledge_name", ASCENDING)]),
+    ],
+    "saviors": [IndexModel([("savior_id", ASCENDING)], unique=True)],
+    "emission_totals": [
+        IndexModel(
+            [
+                ("savior_id", ASCENDING),
+                ("period", ASCENDING),
+                ("period_start", ASCENDING),
+            ],
+            unique=True,
+        )
+    ],
+}
+
+
+def ensure_indexes(db: Database) -> None:
+    """Creates every index the hot queries rely on. Indexes that
+    already exist are left as they are, so it's safe to run on every start.
+    One that conflicts with an existing index or with duplicate documents
+    is reported and skipped, the rest are still created"""
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            try:
+                db[collection].create_indexes([index])
+            except OperationFailure as e:
+                logging.warning(
+                    f"Could not create index {index.document['name']} "
+                    f"on {collection}: {e!r}"
+                )
+
+
+def hot_queries(savior_id: str) -> list[tuple[str, dict]]:
+    """The filters of the queries made on every conversation, by collection"""
+    now = datetime.now(tz=timezone.utc)
+    return [
+        ("logs", {"savior_id": savior_id, "created": {"$gte": now}}),
+        ("logs", {"savior_id": savior_id, "activity": {"$nin": []}}),
+        ("log_rollups", {"savior_id": savior_id, "day": {"$lt": now}}),
+        ("log_rollups", {"savior_id": savior_id, "activity": {"$nin": []}}),
+        ("pledges", {"savior_id": savior_id}),
+        ("pledges", {"savior_id": savior_id, "pledge_name": {"$in": []}}),
+        ("saviors", {"savior_id": savior_id}),
+        (
+            "emission_totals",
+            {"savior_id": savior_id, "period": "day", "period_start": now},
+        ),
+    ]
+
+
+def plan_stages(plan: dict) -> list[str]:
+    """Every stage of an explained query plan, however it's nested"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for value in plan.values():
+        children = value if isinstance(value, list) else [value]
+        for child in children:
+            if isinstance(child, dict):
+                stages.extend(plan_stages(child))
+    return stages
+
+
+def check_query_plans(db: Database, savior_id: str) -> None:
+    """Raises if any hot query would scan a whole collection"""
+    collection_scans = [
+        f"{collection} {query}"
+        for collection, query in hot_queries(savior_id)
+        if "COLLSCAN"
+        in plan_stages(
+            db[collection].find(query).explain()["queryPlanner"]["winningPlan"]
+        )
+    ]
+    if collection_scans:
+        raise RuntimeError(
+            "These queries scan their whole collection, run `ensure_indexes`: "
+            + "; ".join(collection_scans)
+        )
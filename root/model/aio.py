@@ -0,0 +1,417 @@
+import os
+import json
+import asyncio
+import inspect
+import itertools
+from io import BytesIO
+from pathlib import Path
+from numbers import Number
+from functools import partial
+from openai import OpenAI, AsyncOpenAI
+from bson import ObjectId
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from datetime import datetime, timedelta, timezone
+from root.model.model import (
+    Model,
+    MessageAssembler,
+    tool_message,
+    tool_error,
+    tool_timeout_error,
+)
+from root.model.tools import ModelTools
+from root.model.rollups import AsyncLogRollups
+from root.model.factors import AsyncEmbeddingCache
+from openai.types.chat import ChatCompletionMessage
+from typing import Callable
+
+
+class AsyncModelTools(ModelTools):
+    """`ModelTools` whose hot path, reading and logging emissions and
+    pledges, awaits the database, embeddings and emission estimates instead
+    of blocking on them. Tools without an async version here are the sync
+    ones, which the model runs in its tool threads
+    """
+
+    __slots__ = ("db", "async_log_rollups", "aget_embeddings")
+
+    def __init__(
+        self,
+        savior_id: str,
+        embeddings_generator: Callable,
+        async_embeddings_generator: Callable,
+    ):
+        client = AsyncIOMotorClient(os.environ.get("MONGO_URI"))
+        # the sync tools share the connections of the client motor wraps
+        self.setup(
+            db=client.delegate.spt,
+            savior_id=savior_id,
+            embeddings_generator=embeddings_generator,
+        )
+        db = client.spt
+        self.db = db
+        self.async_log_rollups = AsyncLogRollups(
+            logs=db.logs, rollups=db.log_rollups, savior_id=savior_id
+        )
+        self.aget_embeddings = AsyncEmbeddingCache(
+            embed=async_embeddings_generator, cache=self.get_embeddings.cache
+        )
+
+    @property
+    def helpers(self):
+        tools, tools_to_functions, prompts = super().helpers
+        self.tools_to_functions = {
+            **tools_to_functions,
+            "get_user_emissions": self.aget_user_emissions,
+            "calculate_emissions": self.acalculate_emissions,
+            "get_active_pledges": self.aget_active_pledges,
+        }
+        return tools, self.tools_to_functions, prompts
+
+    async def asavior(self) -> dict:
+        """Async version of `savior`, sharing its cached profile"""
+        if (savior := self._savior) is None:
+            savior = await self.db.saviors.find_one({"savior_id": self.savior_id})
+            self._savior = savior
+        return savior
+
+    async def alog_emissions(self, document: dict) -> tuple:
+        previous_emissions = await self.aget_user_emissions(
+            "current", from_tool_call=False
+        )
+        co2e = document["co2e"]
+        # a cancelled tool call still finishes the write, or the log would
+        # be kept without being added to the running totals
+        await asyncio.shield(self.awrite_log(document))
+        return co2e, previous_emissions + co2e
+
+    async def awrite_log(self, document: dict) -> None:
+        """Logs an emitting activity and adds it to the running totals"""
+        created = self.logged_at()
+        await self.db.logs.insert_one(
+            {
+                "savior_id": self.savior_id,
+                "created": created,
+                **document
+            }
+        )
+        self.drop_snapshot()
+        self.activity_cache.invalidate()
+        await self.db.emission_totals.bulk_write(
+            self.totals_updates(document["co2e"], created), ordered=False
+        )
+
+    async def aperiod_total(self, period: str) -> Number:
+        period = "day" if period == "today" else period
+        now = self.logged_at()
+        counter = self.period_counter(period, now)
+        period_start = counter["period_start"]
+        emission_totals = self.db.emission_totals
+        if (total := await emission_totals.find_one(counter)) is None:
+            seeding = ObjectId()
+            total = await emission_totals.find_one_and_update(
+                counter,
+                self.seed_total(seeding, now),
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+            if total.get("seeding") == seeding:
+                co2e = await self.async_log_rollups.total_since(
+                    date_start=period_start, until=now
+                )
+                total = await emission_totals.find_one_and_update(
+                    counter,
+                    self.seeded_total(co2e),
+                    return_document=ReturnDocument.AFTER,
+                )
+                await emission_totals.delete_many(
+                    self.older_totals(period, period_start)
+                )
+        if "seeding" in total:
+            return await self.async_log_rollups.total_since(date_start=period_start)
+        return total["co2e"]
+
+    async def aget_user_emissions(
+        self,
+        period: str | None = None,
+        time_delta: dict | None = None,
+        from_tool_call: bool = True,
+    ) -> str | Number:
+        if period == "current":
+            period = (await self.asavior())["emission_frequency"]
+        if period:
+            emissions = await self.aperiod_total(period)
+        elif time_delta:
+            date_start = datetime.now(tz=timezone.utc) - timedelta(**time_delta)
+            emissions = await self.async_log_rollups.total_since(date_start=date_start)
+        return self.make_response(emissions) if from_tool_call else emissions
+
+    async def aget_emission_factor(
+        self, activity: str, activity_unit_type: str
+    ) -> dict:
+        if (emission_factor := self.lookup_emission_factor(
+            activity, activity_unit_type
+        )):
+            return emission_factor
+        query_embeddings = await self.aget_embeddings(text=activity)
+        if self.factor_index is not None:
+            return self.search_factor_index(
+                query_embeddings, activity, activity_unit_type
+            )
+        result = await self.db.emission_factors.aggregate(
+            self.vector_search_pipeline(query_embeddings, activity_unit_type)
+        ).to_list(1)
+        if not result:
+            raise ValueError(f"No emission factor was found for `{activity}`")
+        self.factor_sources["vector_search"] += 1
+        return result[0]
+
+    async def _acalculate(
+        self, activity: str, activity_value: Number, activity_unit: str
+    ) -> dict:
+        activity_unit_type, activity_unit = self._resolve_unit(
+            activity_unit, await self.asavior()
+        )
+        emission_factor = await self.aget_emission_factor(
+            activity=activity, activity_unit_type=activity_unit_type
+        )
+        emissions = await self.ghg_calculator.acall(
+            value=activity_value,
+            activity_id=emission_factor["activity_id"],
+            unit_type=activity_unit_type,
+            unit=activity_unit,
+        )
+        return self.calculation(
+            emissions=emissions,
+            emission_factor=emission_factor,
+            activity=activity,
+            activity_value=activity_value,
+            activity_unit_type=activity_unit_type,
+            activity_unit=activity_unit,
+        )
+
+    async def acalculate_emissions(
+        self,
+        activity: str,
+        activity_value: Number,
+        activity_unit: str,
+        update_user_emissions: bool = False,
+    ) -> str:
+        """Async version of `calculate_emissions`. Without logging the result,
+        the estimate and the user's current emissions are read concurrently"""
+        # logging drops the cached profile, the budget is read before
+        savior = await self.asavior()
+        calculate = self._acalculate(
+            activity=activity,
+            activity_unit=activity_unit,
+            activity_value=activity_value,
+        )
+        if update_user_emissions:
+            co2e, new_total = await self.alog_emissions(await calculate)
+            budget_left = self.make_response(
+                savior["emissions_budget"] - new_total
+            )
+            return (f"Emissions updated: {self.make_response(co2e)}. "
+                    f"CO2e Budget left: {budget_left}")
+        emissions, curr_emissions = await asyncio.gather(
+            calculate, self.aget_user_emissions("current", from_tool_call=False)
+        )
+        co2e = emissions["co2e"]
+        remaining_budget = self.make_response(
+            savior["emissions_budget"] - (co2e + curr_emissions)
+        )
+        return (f"Emissions calculated: {self.make_response(co2e)}. "
+                f"User's leftover budget if activity is taken: {remaining_budget}")
+
+    async def aget_active_pledges(self, pledge_names: list[str] = []) -> str:
+        pledge_impacts = await self.db.pledges.aggregate(
+            self.pledge_impacts_pipeline(pledge_names)
+        ).to_list(None)
+        return str(pledge_impacts) or (f"No pledges with names {pledge_names} were found. "
+                                        "Try listing the user's active pledges to them")
+
+    async def aclose(self) -> None:
+        await self.ghg_calculator.aclose()
+        self.db.client.close()
+
+
+class AsyncModel(Model):
+    """`Model` on `AsyncOpenAI`, for running many queries, of one or many
+    amulets, in a single event loop. Tools may be coroutine functions, which
+    are awaited, or plain functions, which run in the tool threads
+    """
+
+    __slots__ = ()
+
+    def __init__(self, savior_id: str, amulet_tools: dict[str, Callable]):
+        self.client = AsyncOpenAI()
+        # the sync tools and the vision model run in threads, on a blocking client
+        sync_client = OpenAI()
+        model_tools = AsyncModelTools(
+            savior_id=savior_id,
+            embeddings_generator=lambda text: sync_client.embeddings.create(
+                input=text, model="text-embedding-3-small"
+            ).data[0].embedding,
+            async_embeddings_generator=self.generate_embeddings,
+        )
+        self.setup(
+            model_tools=model_tools,
+            amulet_tools=amulet_tools,
+            vision_client=sync_client,
+        )
+
+    async def audio_to_text(self, audio_buffer: BytesIO | str) -> str:
+        if isinstance(audio_buffer, str):
+            with open(audio_buffer, "rb") as audio_file:
+                audio_buffer = BytesIO(audio_file.read())
+        text = await self.client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(getattr(audio_buffer, "name", self.audio_input_file), audio_buffer),
+            prompt=self.prompts["audio"],
+        )
+        return text.text
+
+    async def text_to_audio(self, text: str, output_file: str | None = None) -> bytes:
+        audio = await self.client.audio.speech.create(
+            input=text,
+            model="tts-1",
+            voice=self.tts_voice,
+            speed=1.05,
+            response_format=self.tts_format,
+        )
+        audio_bytes = await audio.aread()
+        if self.debug_audio_files:
+            with open(output_file or self.audio_output_file, "wb") as f:
+                f.write(audio_bytes)
+        return audio_bytes
+
+    async def moderate(self, text: str) -> bool:
+        response = await self.client.moderations.create(input=text)
+        return response.results[0].flagged
+
+    async def generate_embeddings(self, text: str) -> list:
+        response = await self.client.embeddings.create(
+            input=text, model="text-embedding-3-small"
+        )
+        return response.data[0].embedding
+
+    async def get_chat_completion(
+        self, messages: list[dict], tools: list = None, stream: bool = False
+    ):
+        return await self.client.chat.completions.create(
+            model="gpt-3.5-turbo",
+            messages=messages,
+            tools=tools,
+            temperature=self.chat_temperature,
+            stream=stream,
+        )
+
+    async def stream_chat_completion(
+        self, messages: list[dict], on_sentence: Callable, tools: list = None
+    ) -> ChatCompletionMessage:
+        response = await self.get_chat_completion(
+            messages=messages, tools=tools, stream=True
+        )
+        assembler = MessageAssembler()
+        async for chunk in response:
+            for sentence in assembler.add(chunk):
+                on_sentence(sentence)
+        sentences, message = assembler.finish()
+        for sentence in sentences:
+            on_sentence(sentence)
+        return message
+
+    def sentence_speaker(self, speech_queue: asyncio.Queue) -> Callable:
+        """Returns a callback that synthesizes each sentence it is given in a
+        task, queueing the pending clips in order for playback
+        """
+        output_file = Path(self.audio_output_file)
+        clip_numbers = itertools.count()
+
+        def speak(sentence: str) -> None:
+            clip_file = output_file.with_stem(
+                f"{output_file.stem}_{next(clip_numbers)}"
+            )
+            speech_queue.put_nowait(
+                asyncio.ensure_future(self.text_to_audio(sentence, str(clip_file)))
+            )
+
+        return speak
+
+    async def call_tools(self, tool_calls: list, messages: list) -> list:
+        """Awaits every tool call requested by the model at once, each with
+        its own timeout. Plain functions run in the tool threads"""
+        loop = asyncio.get_running_loop()
+        tools_to_functions = self.tools_to_functions
+
+        async def call_tool(tool) -> tuple[str, bool]:
+            function_name = tool.function.name
+            function_call = tools_to_functions[function_name]
+            arguments = json.loads(tool.function.arguments)
+            if inspect.iscoroutinefunction(function_call):
+                pending = function_call(**arguments)
+            else:
+                pending = loop.run_in_executor(
+                    self.tool_pool, partial(function_call, **arguments)
+                )
+            timeout = self.tool_timeouts.get(function_name, self.tool_timeout)
+            try:
+                return await asyncio.wait_for(pending, timeout), True
+            except TimeoutError:
+                return tool_timeout_error(function_name, timeout), False
+            except Exception as e:
+                return tool_error(e), False
+
+        responses = await asyncio.gather(*map(call_tool, tool_calls))
+        requested_user_view = False
+        for tool, (function_response, succeeded) in zip(tool_calls, responses):
+            requested_user_view |= (
+                succeeded and tool.function.name == "describe_user_view"
+            )
+            messages.append(tool_message(tool, function_response))
+        return messages, requested_user_view
+
+    async def __call__(
+        self,
+        audio_input: BytesIO,
+        speech_queue: asyncio.Queue | None = None,
+        text: str | None = None,
+    ) -> bytes | None:
+        """Async version of `Model.__call__`. When streaming, `speech_queue`
+        receives a task per audio clip, in order, and then None
+        """
+        if self.prefetch_tools:
+            self.model_tools.prefetch()
+        try:
+            text = text or await self.audio_to_text(audio_buffer=audio_input)
+            turn, result = self.turn(text, respond=self.responder(speech_queue)), None
+            try:
+                while True:
+                    call, kwargs = turn.send(result)
+                    result = await call(**kwargs)
+            except StopIteration as done:
+                response_message = done.value
+        finally:
+            self.model_tools.drop_snapshot()
+            if speech_queue is not None:
+                speech_queue.put_nowait(None)
+        if speech_queue is None and (res := response_message.content):
+            return await self.text_to_audio(res)
+
+    def responder(self, speech_queue: asyncio.Queue | None) -> Callable:
+        if speech_queue is None:
+            async def respond(messages, tools):
+                response = await self.get_chat_completion(
+                    messages=messages, tools=tools
+                )
+                return response.choices[0].message
+
+            return respond
+        speak = self.sentence_speaker(speech_queue)
+        return lambda messages, tools: self.stream_chat_completion(
+            messages=messages, on_sentence=speak, tools=tools
+        )
+
+    async def aclose(self) -> None:
+        await self.model_tools.aclose()
+        await self.client.close()
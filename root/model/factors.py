@@ -0,0 +1,144 @@
+import re
+import hashlib
+import numpy as np
+from typing import Callable
+from pymongo.collection import Collection
+from root.cache import TTLCache
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases text and collapses its punctuation and whitespace,
+    so trivially different phrasings of an activity compare equal"""
+    return " ".join(re.sub(r"[^\w\s]", " ", text.lower()).split())
+
+
+class EmbeddingCache:
+    """Content addressed cache in front of an embeddings generator,
+    keyed by a hash of the normalized text"""
+
+    __slots__ = ("embed", "cache")
+
+    def __init__(self, embed: Callable[..., list], cache: TTLCache):
+        self.embed = embed
+        self.cache = cache
+
+    @staticmethod
+    def key(normalized: str) -> str:
+        return hashlib.sha256(normalized.encode()).hexdigest()
+
+    def __call__(self, text: str) -> list:
+        normalized = normalize_text(text)
+        key = self.key(normalized)
+        if (embeddings := self.cache.get(key)) is None:
+            embeddings = self.embed(text=normalized)
+            self.cache.set(key, embeddings)
+        return embeddings
+
+
+class AsyncEmbeddingCache(EmbeddingCache):
+    """`EmbeddingCache` in front of an async embeddings generator"""
+
+    __slots__ = ()
+
+    async def __call__(self, text: str) -> list:
+        normalized = normalize_text(text)
+        key = self.key(normalized)
+        if (embeddings := self.cache.get(key)) is None:
+            embeddings = await self.embed(text=normalized)
+            self.cache.set(key, embeddings)
+        return embeddings
+
+
+class FactorIndex:
+    """An in-memory vector index over the emission factor catalog.
+
+    Embeddings are kept as one float32 matrix of unit rows, so cosine
+    similarity against a batch of queries is a single matrix product.
+    """
+
+    __slots__ = ("factors", "embeddings", "unit_type_masks")
+
+    def __init__(self, factors: list[dict], embeddings: np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if not factors:
+            # an empty catalog has no embedding to take the dimension from
+            embeddings = embeddings.reshape(0, 0)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        self.embeddings = embeddings / np.maximum(norms, 1e-12)
+        self.factors = factors
+        unit_types = {u for f in factors for u in f.get("unit_types", [])}
+        self.unit_type_masks = {
+            unit_type: np.array([unit_type in f.get("unit_types", []) for f in factors])
+            for unit_type in unit_types
+        }
+
+    @classmethod
+    def from_collection(
+        cls, collection: Collection, embedding_path: str, filter: dict | None = None
+    ) -> "FactorIndex":
+        factors, embeddings = [], []
+        for factor in collection.find(filter or {}, {"_id": 0}):
+            if (embedding := factor.pop(embedding_path, None)) is not None:
+                factors.append(factor)
+                embeddings.append(embedding)
+        return cls(factors=factors, embeddings=np.array(embeddings))
+
+    def search(
+        self, queries: list | np.ndarray, k: int = 1, unit_type: str | None = None
+    ) -> list[list[dict]]:
+        """The `k` most similar factors to each query, best first
+
+        Args:
+            queries: one query embedding, or a batch of them
+            k: how many factors to return per query
+            unit_type (optional): only consider factors with this unit type
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.factors:
+            return [[] for _ in queries]
+        # not in place, `queries` may be the caller's array
+        queries = queries / np.maximum(
+            np.linalg.norm(queries, axis=1, keepdims=True), 1e-12
+        )
+        scores = queries @ self.embeddings.T
+        if unit_type is not None:
+            mask = self.unit_type_masks.get(
+                unit_type, np.zeros(len(self.factors), dtype=bool)
+            )
+            scores[:, ~mask] = -np.inf
+        k = min(k, scores.shape[1])
+        if k < 1:
+            return [[] for _ in queries]
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.take_along_axis(top, np.argsort(-top_scores, axis=1), axis=1)
+        return [
+            [self.factors[i] for i in row if np.isfinite(scores[q, i])]
+            for q, row in enumerate(order)
+        ]
+
+
+class FactorLookup:
+    """Exact matches of an activity's normalized name, or one of its aliases,
+    to an emission factor. Checked before any semantic search"""
+
+    __slots__ = ("factors",)
+
+    def __init__(self, factors: list[dict], alias_field: str = "aliases"):
+        self.factors = {}
+        for factor in factors:
+            names = [factor.get("activity", ""), *factor.get(alias_field, [])]
+            for name in filter(None, map(normalize_text, names)):
+                for unit_type in factor.get("unit_types", []):
+                    # the first factor listed for a name wins
+                    self.factors.setdefault((name, unit_type), factor)
+
+    @classmethod
+    def from_collection(
+        cls, collection: Collection, embedding_path: str, filter: dict | None = None
+    ) -> "FactorLookup":
+        factors = collection.find(filter or {}, {"_id": 0, embedding_path: 0})
+        return cls(factors=list(factors))
+
+    def get(self, activity: str, unit_type: str) -> dict | None:
+        return self.factors.get((normalize_text(activity), unit_type))
@@ -1,23 +1,129 @@
+import re
 import json
+import time
 import base64
+import itertools
 from io import BytesIO
+from queue import Queue
+from pathlib import Path
 from openai import OpenAI
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
 from config import Config
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from root.model.tools import ModelTools
-from typing import Callable
+from root.model.thread import ThreadCompactor
+from typing import Callable, Generator
+
+# a sentence ends at terminal punctuation followed by whitespace,
+# so decimals like 2.5 are left alone
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> tuple[list[str], str]:
+    """Splits text into its complete sentences and the unfinished remainder"""
+    *sentences, remainder = SENTENCE_END.split(text)
+    return sentences, remainder
+
+
+def tool_message(tool: ChatCompletionMessageToolCall, content: str) -> dict:
+    """The message answering a tool call with its result"""
+    return {
+        "tool_call_id": tool.id,
+        "role": "tool",
+        "name": tool.function.name,
+        "content": content,
+    }
+
+
+def tool_error(error: Exception) -> str:
+    return (
+        f"Error: {repr(error)}. "
+        "Ask the user for more information before continuing."
+    )
+
+
+def tool_timeout_error(function_name: str, timeout: float) -> str:
+    return (
+        f"Error: {function_name} took longer than {timeout} seconds. "
+        "Tell the user it can't be done right now."
+    )
+
+
+class MessageAssembler:
+    """Reassembles a streamed chat completion message from its chunks,
+    splitting its content into sentences as they complete"""
+
+    __slots__ = ("content", "pending", "tool_calls")
+
+    def __init__(self):
+        self.content, self.pending, self.tool_calls = [], "", {}
+
+    def add(self, chunk) -> list[str]:
+        """Adds a streamed chunk, returning the sentences it completed"""
+        if not chunk.choices:
+            return []
+        delta, sentences = chunk.choices[0].delta, []
+        if delta.content:
+            self.content.append(delta.content)
+            sentences, self.pending = split_sentences(self.pending + delta.content)
+        # tool calls arrive in fragments, keyed by their index
+        for tool_delta in delta.tool_calls or []:
+            tool_call = self.tool_calls.setdefault(
+                tool_delta.index, {"id": None, "name": "", "arguments": ""}
+            )
+            tool_call["id"] = tool_delta.id or tool_call["id"]
+            if (function := tool_delta.function):
+                tool_call["name"] += function.name or ""
+                tool_call["arguments"] += function.arguments or ""
+        return sentences
+
+    def finish(self) -> tuple[list[str], ChatCompletionMessage]:
+        """The last, unterminated sentence if any, and the assembled message"""
+        remainder = self.pending.strip()
+        tool_calls = [
+            ChatCompletionMessageToolCall(
+                id=tool_call["id"],
+                type="function",
+                function=Function(
+                    name=tool_call["name"], arguments=tool_call["arguments"]
+                ),
+            )
+            for _, tool_call in sorted(self.tool_calls.items())
+        ]
+        message = ChatCompletionMessage(
+            role="assistant",
+            content="".join(self.content) or None,
+            tool_calls=tool_calls or None,
+        )
+        return [remainder] if remainder else [], message
 
 
 class Model:
     __slots__ = (
         "client",
         "model",
+        "model_tools",
         "prompts",
         "tools",
         "tools_to_functions",
         "_current_thread",
         "tts_voice",
         "tts_speed",
+        "tts_pool",
+        "tool_pool",
+        "tool_timeout",
+        "tool_timeouts",
+        "chat_temperature",
+        "vision_temperature",
+        "max_vision_tokens",
+        "audio_input_file",
+        "audio_output_file",
+        "debug_audio_files",
+        "tts_format",
+        "prefetch_tools",
+        "compact_thread",
     )
 
     def __init__(self, savior_id: str, amulet_tools: dict[str, Callable]):
@@ -26,10 +132,21 @@ class Model:
         model_tools = ModelTools(
             embeddings_generator=self.generate_embeddings, savior_id=savior_id
         )
+        self.setup(
+            model_tools=model_tools, amulet_tools=amulet_tools, vision_client=client
+        )
+
+    def setup(
+        self, model_tools: ModelTools, amulet_tools: dict, vision_client: OpenAI
+    ) -> None:
+        """Registers the model's tools and reads its settings"""
+        self.model_tools = model_tools
         self.tools, tools_to_functions, self.prompts = model_tools.helpers
         get_amulet_view = amulet_tools.pop("get_view")
         vision_model = VisionModel(
-            client=client, get_image = get_amulet_view, prompt=self.prompts["vision"]
+            client=vision_client,
+            get_image=get_amulet_view,
+            prompt=self.prompts["vision"],
         )
         self.tools_to_functions = {
             **tools_to_functions, 
@@ -38,12 +155,26 @@ class Model:
         }
         self.tts_voice = model_tools.savior["tts_voice"]
         config = Config()
-        self.tts_speeed = config.tts_speed
+        self.tts_speed = config.tts_speed
         self.chat_temperature = config.chat_temperature
         self.vision_temperature = config.vision_temperature
         self.max_vision_tokens = config.max_vision_tokens
         self.audio_input_file = config.audio_input_file
-        self.audio_output_file = config.audio_output_file
+        self.tts_format = config.tts_file_format
+        # debug copies of the speech are named after the format they're in
+        self.audio_output_file = str(
+            Path(config.audio_output_file).with_suffix(f".{self.tts_format}")
+        )
+        self.debug_audio_files = config.debug_audio_files
+        self.tts_pool = ThreadPoolExecutor(max_workers=config.tts_workers)
+        self.tool_pool = ThreadPoolExecutor(max_workers=config.tool_workers)
+        self.tool_timeout = config.tool_timeout
+        self.tool_timeouts = config.tool_timeouts
+        self.prefetch_tools = config.prefetch_tools
+        self.compact_thread = ThreadCompactor(
+            budget=config.thread_token_budget,
+            tool_output_chars=config.thread_tool_output_chars,
+        )
         self._current_thread = {"last_interaction": datetime.now(), "thread": []}
 
     @property
@@ -62,35 +193,51 @@ class Model:
 
     @current_thread.setter
     def current_thread(self, messages: list) -> None:
-        self._current_thread = {"last_interaction": datetime.now(), "thread": messages}
+        """Keeps the thread, compacted to the token budget"""
+        self._current_thread = {
+            "last_interaction": datetime.now(),
+            "thread": self.compact_thread(messages),
+        }
 
 
-    # def audio_to_text(self, audio_file: str) -> str:
-    #     """Turns audio bytes into text for a chat completion"""
-    #     with open(audio_file, "rb") as audio_bytes:
-    #         text = self.client.audio.transcriptions.create(
-    #             model="whisper-1", file=audio_bytes, prompt=self.prompts["audio"]
-    #         )
-    #     print(text.text)
-    #     return text.text
+    def audio_to_text(self, audio_buffer: BytesIO | str) -> str:
+        """Turns recorded audio into text for a chat completion
 
-    def text_to_audio(self, text: str) -> str:
-        """Writes the given text to an audio file for the amulet to handle"""
+        Args:
+            audio_buffer: an in-memory wav recording, or the path to one
+        """
+        if isinstance(audio_buffer, str):
+            with open(audio_buffer, "rb") as audio_file:
+                return self.audio_to_text(audio_buffer=BytesIO(audio_file.read()))
+        text = self.client.audio.transcriptions.create(
+            model="whisper-1",
+            file=(getattr(audio_buffer, "name", self.audio_input_file), audio_buffer),
+            prompt=self.prompts["audio"],
+        )
+        return text.text
 
-        output_filepath = self.audio_output_file
+    def text_to_audio(self, text: str, output_file: str | None = None) -> bytes:
+        """Synthesizes the given text into audio for the amulet to play.
+        The audio is only written to a file when debugging audio files"""
 
         audio = self.client.audio.speech.create(
-            input=text, model="tts-1", voice=self.tts_voice, speed=1.05
+            input=text,
+            model="tts-1",
+            voice=self.tts_voice,
+            speed=1.05,
+            response_format=self.tts_format,
         )
-
-        audio.stream_to_file(output_filepath)
-        return output_filepath
+        audio_bytes = audio.read()
+        if self.debug_audio_files:
+            with open(output_file or self.audio_output_file, "wb") as f:
+                f.write(audio_bytes)
+        return audio_bytes
 
     def moderate(self, text: str) -> bool:
         """Moderates the given text"""
         response = self.client.moderations.create(input=text)
 
-        return response.result[0].flagged
+        return response.results[0].flagged
 
     def format_inputs(self, content: str, prompt: str | None) -> list:
         """Properly formats a query for a completions model
@@ -171,21 +318,68 @@ class Model:
         )        
         return response
 
-    def get_chat_completion(self, messages: list[dict], tools: list = None) -> dict:
+    def get_chat_completion(
+        self, messages: list[dict], tools: list = None, stream: bool = False
+    ) -> dict:
         """Returns a chat completion response from a text-only model"""
 
         res = self.client.chat.completions.create(
             model="gpt-3.5-turbo",
             messages=messages,
             tools=tools,
-            temperature=self.chat_temperature
+            temperature=self.chat_temperature,
+            stream=stream,
         )
 
         return res
 
+    def stream_chat_completion(
+        self, messages: list[dict], on_sentence: Callable, tools: list = None
+    ) -> ChatCompletionMessage:
+        """Streams a chat completion, handing each complete sentence of its
+        content to `on_sentence` as soon as it arrives
+
+        Args:
+            messages: the thread to continue
+            on_sentence: called with every finished sentence of the response
+            tools: the tools the model may request
+
+        Returns: the assembled response message, including any tool calls
+        """
+        response = self.get_chat_completion(
+            messages=messages, tools=tools, stream=True
+        )
+        assembler = MessageAssembler()
+        for chunk in response:
+            for sentence in assembler.add(chunk):
+                on_sentence(sentence)
+        sentences, message = assembler.finish()
+        for sentence in sentences:
+            on_sentence(sentence)
+        return message
+
+    def sentence_speaker(self, speech_queue: Queue) -> Callable:
+        """Returns a callback that synthesizes each sentence it is given in the
+        background, queueing the pending clips in order for playback
+        """
+        output_file = Path(self.audio_output_file)
+        clip_numbers = itertools.count()
+
+        def speak(sentence: str) -> None:
+            clip_file = output_file.with_stem(
+                f"{output_file.stem}_{next(clip_numbers)}"
+            )
+            speech_queue.put(
+                self.tts_pool.submit(self.text_to_audio, sentence, str(clip_file))
+            )
+
+        return speak
+
     def call_tools(self, tool_calls: list, messages: list) -> list:
-        """Loops through a given list of function call requests from a model
-        and then feeds the response back to it for the final output
+        """Runs a given list of function call requests from a model concurrently
+        and then feeds the responses back to it for the final output. A tool
+        that runs past its timeout responds with an error instead, tools
+        with a timeout of None are waited for
 
         Args:
             tool_calls: the tool calls requested by the model
@@ -196,60 +390,107 @@ class Model:
 
         """
         tools_to_functions = self.tools_to_functions
+
+        def call_tool(tool) -> str:
+            function_call = tools_to_functions[tool.function.name]
+            arguments = json.loads(tool.function.arguments)
+            return function_call(**arguments)
+
+        # independent tool calls run concurrently, results keep the model's order
+        started = time.monotonic()
+        pending = [self.tool_pool.submit(call_tool, tool) for tool in tool_calls]
         requested_user_view = []
-        for tool in tool_calls:
+        for tool, future in zip(tool_calls, pending):
+            function_name = tool.function.name
+            timeout = self.tool_timeouts.get(function_name, self.tool_timeout)
             try:
-                function_name = tool.function.name
-                function_call = tools_to_functions[function_name]
-                arguments = json.loads(tool.function.arguments)
-                function_response = function_call(**arguments)
+                function_response = future.result(
+                    timeout=None if timeout is None
+                    else max(started + timeout - time.monotonic(), 0)
+                )
                 requested_user_view.append(function_name == "describe_user_view")
+            except TimeoutError:
+                function_response = tool_timeout_error(function_name, timeout)
             except Exception as e:
-                function_response = f"Error: {repr(e)}. Ask the user for more information before continuing."
-            messages.append(
-                {
-                    "tool_call_id": tool.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": function_response,
-                }
-            )
+                function_response = tool_error(e)
+            messages.append(tool_message(tool, function_response))
         return messages, any(requested_user_view)
 
-    def __call__(self, audio_input: BytesIO) -> str:
-        """End to end function that handles an input audio file of
-        a user query and returns another audio file
+    def __call__(
+        self,
+        audio_input: BytesIO,
+        speech_queue: Queue | None = None,
+        text: str | None = None,
+    ) -> bytes | None:
+        """End to end function that handles an input audio recording of
+        a user query and returns the audio of the response
 
         Args:
-            audio_bytes: The recorded bytes of the user's query
+            audio_input: The recorded wav of the user's query
+            speech_queue (optional): when given, the response is streamed and
+            every sentence is synthesized as soon as it is generated. The queue
+            receives a future per audio clip, in order, and then None
+            text (optional): the query, if it was already transcribed while recording
+
+        Returns: The encoded audio of the tts response,
+        or None when streaming into `speech_queue`
+        """
+        if self.prefetch_tools:
+            self.model_tools.prefetch()
+        try:
+            text = text or self.audio_to_text(audio_buffer=audio_input)
+            turn, result = self.turn(text, respond=self.responder(speech_queue)), None
+            try:
+                while True:
+                    call, kwargs = turn.send(result)
+                    result = call(**kwargs)
+            except StopIteration as done:
+                response_message = done.value
+        finally:
+            self.model_tools.drop_snapshot()
+            if speech_queue is not None:
+                speech_queue.put(None)
+        if speech_queue is None and (res := response_message.content):
+            return self.text_to_audio(res)
+
+    def responder(self, speech_queue: Queue | None) -> Callable:
+        """The call that gets the model's response message, streaming its
+        sentences into `speech_queue` when given"""
+        if speech_queue is None:
+            return lambda messages, tools: self.get_chat_completion(
+                messages=messages, tools=tools
+            ).choices[0].message
+        speak = self.sentence_speaker(speech_queue)
+        return lambda messages, tools: self.stream_chat_completion(
+            messages=messages, on_sentence=speak, tools=tools
+        )
 
-        Returns: An audio file location reference containing the tts response
+    def turn(self, text: str, respond: Callable) -> Generator:
+        """The steps of answering a query, for both the sync and the async
+        model. Yields each call to make with its keyword arguments, is sent
+        back its result, and returns the final response message
+
+        Args:
+            text: the user's query
+            respond: the call that gets the model's response message
         """
-        text = self.audio_to_text(audio_buffer=audio_input)
+        if (yield self.moderate, {"text": text}):
+            raise Exception("The query was flagged by moderations")
         prompt = self.prompts["chat"] if not self.current_thread else None
         messages = self.format_inputs(content=text, prompt=prompt)
-        response = self.get_chat_completion(messages=messages, tools=self.tools)
-        response_message = response.choices[0].message
-
-        is_flagged = self.moderate(messages)
-        if is_flagged:
-            raise Exception("The query was flagged by moderations")
-        # create ref instead of rekeying in the loop
-        tool_calls, call_tools = response_message.tool_calls, self.call_tools
-        while tool_calls:
+        response_message = yield respond, {"messages": messages, "tools": self.tools}
+        while tool_calls := response_message.tool_calls:
             messages.append(response_message)
-            messages, requested_user_view = call_tools(
-                tool_calls=tool_calls, messages=messages
-            )
-            response = self.get_chat_completion(
-                messages=messages, tools=self.tools if requested_user_view else None
-            )  # can add tools here too
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
+            messages, requested_user_view = yield self.call_tools, {
+                "tool_calls": tool_calls, "messages": messages
+            }
+            response_message = yield respond, {
+                "messages": messages,
+                "tools": self.tools if requested_user_view else None,
+            }  # can add tools here too
         messages.append(response_message)
         self.current_thread = messages
-        if (res := response_message.content): 
-            return self.text_to_audio(res)
+        return response_message
 
 
 class VisionModel:
@@ -0,0 +1,174 @@
+from numbers import Number
+from datetime import datetime, timedelta, timezone
+from pymongo.collection import Collection
+
+
+class LogRollups:
+    """Folds a user's raw emission logs into one bucket document per day
+    and activity, so totals over long periods read a handful of buckets
+    instead of every log. Only today's logs, which aren't rolled up yet,
+    are read raw.
+
+    Rolling up replaces whole days, so re-running it is harmless.
+    """
+
+    __slots__ = ("logs", "rollups", "savior_id", "rolled_up_to")
+
+    def __init__(self, logs: Collection, rollups: Collection, savior_id: str):
+        self.logs = logs
+        self.rollups = rollups
+        self.savior_id = savior_id
+        self.rolled_up_to = None
+
+    @staticmethod
+    def today() -> datetime:
+        now = datetime.now(tz=timezone.utc)
+        return datetime(now.year, now.month, now.day, tzinfo=timezone.utc)
+
+    def merge_pipeline(self, since: datetime, today: datetime) -> list:
+        """Stages to run on the logs collection that merge every day of logs
+        from `since` up to `today` into buckets"""
+        return [
+            {
+                "$match": {
+                    "savior_id": self.savior_id,
+                    "created": {"$gte": since, "$lt": today},
+                }
+            },
+            {
+                "$group": {
+                    "_id": {
+                        "savior_id": "$savior_id",
+                        "day": {"$dateTrunc": {"date": "$created", "unit": "day"}},
+                        "activity": "$activity",
+                    },
+                    "co2e": {"$sum": "$co2e"},
+                    "logs": {"$sum": 1},
+                    "activity_unit_type": {"$first": "$activity_unit_type"},
+                }
+            },
+            {
+                "$set": {
+                    "savior_id": "$_id.savior_id",
+                    "day": "$_id.day",
+                    "activity": "$_id.activity",
+                }
+            },
+            {
+                "$merge": {
+                    "into": self.rollups.name,
+                    "on": "_id",
+                    "whenMatched": "replace",
+                    "whenNotMatched": "insert",
+                }
+            },
+        ]
+
+    def roll_up(self) -> None:
+        """Merges every complete day of logs since the last bucket into buckets"""
+        today = self.today()
+        if self.rolled_up_to == today:
+            return
+        last_bucket = self.rollups.find_one(
+            {"savior_id": self.savior_id}, {"day": 1}, sort=[("day", -1)]
+        )
+        # the last day is rolled up again in case logs came in after it was
+        since = last_bucket["day"] if last_bucket else datetime.min
+        self.logs.aggregate(self.merge_pipeline(since, today))
+        self.rolled_up_to = today
+
+    def union_pipeline(
+        self,
+        match: dict,
+        date_start: datetime | None = None,
+        until: datetime | None = None,
+    ) -> list:
+        """Stages to run on the rollups collection that output a document per
+        bucket, and per raw log not in a bucket, since `date_start`. Buckets
+        and logs both have `activity`, `co2e` and `activity_unit_type` fields
+
+        Args:
+            match: extra filters for both buckets and logs
+            date_start (optional): when to start from, defaults to the first log
+            until (optional): the last moment to include logs from, defaults to now
+
+        Call `roll_up` first, or the days since the last one are missed.
+        """
+        today = self.today()
+        date_start = date_start or datetime.min.replace(tzinfo=timezone.utc)
+        fields = {"activity": 1, "co2e": 1, "activity_unit_type": 1}
+        if date_start >= today:
+            bucket_days = {"$lt": datetime.min}
+            raw_logs = {"created": {"$gte": date_start}}
+        else:
+            first_full_day = datetime(
+                date_start.year, date_start.month, date_start.day, tzinfo=timezone.utc
+            )
+            if first_full_day < date_start:
+                first_full_day += timedelta(days=1)
+            bucket_days = {"$gte": first_full_day, "$lt": today}
+            # logs from a partial first day, and today's
+            raw_logs = {
+                "$or": [
+                    {"created": {"$gte": date_start, "$lt": first_full_day}},
+                    {"created": {"$gte": today}},
+                ]
+            }
+        if until is not None:
+            raw_logs = {"$and": [raw_logs, {"created": {"$lte": until}}]}
+        return [
+            {"$match": {"savior_id": self.savior_id, "day": bucket_days, **match}},
+            {"$project": fields},
+            {
+                "$unionWith": {
+                    "coll": self.logs.name,
+                    "pipeline": [
+                        {"$match": {"savior_id": self.savior_id, **raw_logs, **match}},
+                        {"$project": fields},
+                    ],
+                }
+            },
+        ]
+
+    def total_since(
+        self, date_start: datetime, until: datetime | None = None
+    ) -> Number:
+        """Sums the user's emissions since `date_start`, up to `until` if given"""
+        self.roll_up()
+        emissions = self.rollups.aggregate(
+            [
+                *self.union_pipeline(match={}, date_start=date_start, until=until),
+                {"$group": {"_id": None, "emissions": {"$sum": "$co2e"}}},
+            ]
+        )
+        return next(emissions, {"emissions": 0})["emissions"]
+
+
+class AsyncLogRollups(LogRollups):
+    """`LogRollups` over async collections, like motor's"""
+
+    __slots__ = ()
+
+    async def roll_up(self) -> None:
+        today = self.today()
+        if self.rolled_up_to == today:
+            return
+        last_bucket = await self.rollups.find_one(
+            {"savior_id": self.savior_id}, {"day": 1}, sort=[("day", -1)]
+        )
+        since = last_bucket["day"] if last_bucket else datetime.min
+        # an async aggregation only runs once its cursor is read
+        await self.logs.aggregate(self.merge_pipeline(since, today)).to_list(None)
+        self.rolled_up_to = today
+
+    async def total_since(
+        self, date_start: datetime, until: datetime | None = None
+    ) -> Number:
+        await self.roll_up()
+        emissions = await self.rollups.aggregate(
+            [
+                *self.union_pipeline(match={}, date_start=date_start, until=until),
+                {"$group": {"_id": None, "emissions": {"$sum": "$co2e"}}},
+            ]
+        ).to_list(1)
+        return emissions[0]["emissions"] if emissions else 0
@@ -0,0 +1,105 @@
+from pydantic import BaseModel
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# every message costs a few tokens of framing on top of its content
+MESSAGE_OVERHEAD = 4
+
+
+class ThreadCompactor:
+    """Keeps a conversation thread under a token budget. The system prompt
+    is always kept, tool outputs of earlier turns are cut short first, and
+    then the oldest turns are dropped whole, so tool calls are never
+    separated from their results.
+
+    Tokens are counted with tiktoken if it's installed. It's optional, and
+    left out of the requirements, without it they're estimated at about
+    four characters each, which is close enough to keep under the budget.
+    """
+
+    __slots__ = ("budget", "tool_output_chars", "encoding")
+
+    def __init__(
+        self, budget: int, tool_output_chars: int = 200, model: str = "gpt-3.5-turbo"
+    ):
+        """
+        Args:
+            budget: the most tokens to keep in the thread
+            tool_output_chars: how much of an earlier turn's tool output to keep
+            model: the model whose tokenizer to count with
+        """
+        self.budget = budget
+        self.tool_output_chars = tool_output_chars
+        self.encoding = tiktoken.encoding_for_model(model) if tiktoken else None
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is None:
+            return (len(text) + 3) // 4
+        return len(self.encoding.encode(text))
+
+    @staticmethod
+    def text(content: str | list | None) -> str:
+        """The text of a message's content, which may be a list of parts"""
+        if isinstance(content, list):
+            return "".join(
+                part.get("text") or "" for part in content if isinstance(part, dict)
+            )
+        return content or ""
+
+    def message_tokens(self, message: dict) -> int:
+        tokens = MESSAGE_OVERHEAD + self.count_tokens(self.text(message.get("content")))
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call["function"]
+            tokens += self.count_tokens(function["name"] + function["arguments"])
+        return tokens
+
+    @staticmethod
+    def as_dict(message: dict | BaseModel) -> dict:
+        """Messages from the api are stored as plain dicts, like the rest"""
+        if isinstance(message, BaseModel):
+            return message.model_dump(exclude_none=True)
+        return message
+
+    @staticmethod
+    def turns(messages: list[dict]) -> list[list[dict]]:
+        """Splits messages into turns, each starting at a user message"""
+        turns = []
+        for message in messages:
+            if message["role"] == "user" or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def shorten_tool_output(self, message: dict) -> dict:
+        if message["role"] != "tool":
+            return message
+        content = message.get("content")
+        if not isinstance(content, str) or len(content) <= self.tool_output_chars:
+            return message
+        return {**message, "content": content[: self.tool_output_chars] + "..."}
+
+    def __call__(self, messages: list) -> list[dict]:
+        """Returns the thread compacted to fit the budget, if it doesn't"""
+        messages = [self.as_dict(message) for message in messages]
+        pinned = messages[:1] if messages and messages[0]["role"] == "system" else []
+        turns = self.turns(messages[len(pinned):])
+        tokens = [sum(map(self.message_tokens, turn)) for turn in turns]
+        used = sum(map(self.message_tokens, pinned)) + sum(tokens)
+        if used <= self.budget:
+            return messages
+        # the latest turn is kept as is, the oldest tool outputs are cut short
+        for i, turn in enumerate(turns[:-1]):
+            if used <= self.budget:
+                break
+            turns[i] = [self.shorten_tool_output(message) for message in turn]
+            shortened = sum(map(self.message_tokens, turns[i]))
+            used -= tokens[i] - shortened
+            tokens[i] = shortened
+        while used > self.budget and len(turns) > 1:
+            turns.pop(0)
+            used -= tokens.pop(0)
+        return pinned + [message for turn in turns for message in turn]
+
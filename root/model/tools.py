@@ -1,9 +1,18 @@
 import os
+import logging
 import pymongo
+from threading import Thread
+from concurrent.futures import Future, ThreadPoolExecutor
 from numbers import Number
-from functools import cached_property
+from config import Config
 from datetime import datetime, timedelta, timezone
 from root.impacts.emissions import GHGCalculator
+from root.impacts.pledges import PledgeScheduler, accrual_stages, checkpoint_pledges
+from root.indexes import ensure_indexes, check_query_plans
+from root.model.rollups import LogRollups
+from root.model.factors import EmbeddingCache, FactorIndex, FactorLookup
+from collections import Counter
+from root.cache import PersistentCache, TTLCache
 from typing import Callable
 from bson import ObjectId
 
@@ -53,6 +62,46 @@ TOOLS = [
             },
         },
     },
+    {
+        "type": "function",
+        "function": {
+            "name": "calculate_emissions_batch",
+            "description": "Calculate the emissions of several activities or items at once, e.g. a whole shopping trip, and optionally update the user's emissions status with the results. Prefer this over calling `calculate_emissions` many times.",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "activities": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "activity": {
+                                    "type": "string",
+                                    "description": "A sequence of words describing the activity/item.",
+                                },
+                                "activity_value": {
+                                    "type": "number",
+                                    "description": "The amount of the activity, e.g. 20 for 20 dollars worth of an item.",
+                                },
+                                "activity_unit": {
+                                    "type": "string",
+                                    "enum": ["money", "kg", "lb", "g", "ton", "t"],
+                                    "description": "The metric that `activity_value` represents, money for a currency amount or the weight metric.",
+                                },
+                            },
+                            "required": ["activity", "activity_value", "activity_unit"],
+                        },
+                        "description": "The activities to calculate emissions for.",
+                    },
+                    "update_user_emissions": {
+                        "type": "boolean",
+                        "description": "If True, the user's emissions status is updated with the results. Defaults to False."
+                    }
+                },
+                "required": ["activities"],
+            },
+        },
+    },
     {
         "type": "function",
         "function": {
@@ -181,6 +230,8 @@ TOOLS = [
     # }
 ]
 
+EMISSION_PERIODS = ("day", "week", "month", "year", "historical")
+
 class ModelTools:
     __slots__ = (
         "savior_id",
@@ -189,28 +240,108 @@ class ModelTools:
         "saviors",
         "emission_factors",
         "emission_logs",
+        "emission_totals",
+        "log_rollups",
         "pledges",
         "prompts",
         "get_embeddings",
         "tools_to_functions",
+        "_savior",
+        "watching_savior",
+        "factor_index",
+        "factor_lookup",
+        "factor_sources",
+        "embedding_path",
+        "prefetch_pool",
+        "_snapshot",
+        "pledge_scheduler",
+        "accrue_pledges",
+        "activity_cache",
     )
     
 
     def __init__(self, savior_id: str, embeddings_generator: Callable):
         connection_string = os.environ.get("MONGO_URI")
-        db = pymongo.MongoClient(connection_string).spt
+        self.setup(
+            db=pymongo.MongoClient(connection_string).spt,
+            savior_id=savior_id,
+            embeddings_generator=embeddings_generator,
+        )
+
+    def setup(
+        self, db: pymongo.database.Database, savior_id: str, embeddings_generator: Callable
+    ) -> None:
+        """Reads the user's profile and settings, and loads what the tools
+        need from the database"""
         self.savior_id = savior_id
         self.emission_factors = db.emission_factors
         self.emission_logs = db.logs
+        self.emission_totals = db.emission_totals
+        self.log_rollups = LogRollups(
+            logs=db.logs, rollups=db.log_rollups, savior_id=savior_id
+        )
         self.pledges = db.pledges
         self.saviors = db.saviors
         self.tools = TOOLS
         self.prompts = PROMPTS
+        self._savior = None
+        config = Config()
+        if config.ensure_indexes:
+            ensure_indexes(db)
+        if config.check_query_plans:
+            check_query_plans(db, savior_id=savior_id)
+        self.watching_savior = config.watch_savior_profile
+        if self.watching_savior:
+            Thread(target=self.watch_savior, daemon=True).start()
+        self.pledge_scheduler = None
+        self.accrue_pledges = config.accrue_pledges
+        if self.accrue_pledges:
+            checkpoint_pledges(db.pledges, {"savior_id": savior_id})
+        elif config.keep_pledges:
+            self.pledge_scheduler = PledgeScheduler(db.pledges)
+            self.pledge_scheduler.load({"savior_id": savior_id})
+            self.pledge_scheduler.start()
         savior = self.savior
         self.ghg_calculator = GHGCalculator(
             region=savior["region"], currency=savior["currency"]
         )
-        self.get_embeddings = embeddings_generator
+        # users repeat the same activities, their embeddings are reused
+        self.get_embeddings = EmbeddingCache(
+            embed=embeddings_generator,
+            cache=PersistentCache(
+                path=config.embedding_cache_file, maxsize=config.embedding_cache_size
+            ),
+        )
+        self.embedding_path = config.emission_factor_embedding_path
+        # resolves emission factors offline instead of with $vectorSearch
+        self.factor_index = (
+            FactorIndex.from_collection(
+                self.emission_factors,
+                embedding_path=self.embedding_path,
+                filter={"source": "partners"},
+            )
+            if config.local_factor_index
+            else None
+        )
+        # most activities are named exactly, those skip the embeddings entirely
+        if not config.factor_name_lookup:
+            self.factor_lookup = None
+        elif self.factor_index is not None:
+            self.factor_lookup = FactorLookup(self.factor_index.factors)
+        else:
+            self.factor_lookup = FactorLookup.from_collection(
+                self.emission_factors,
+                embedding_path=self.embedding_path,
+                filter={"source": "partners"},
+            )
+        # which path resolved each emission factor
+        self.factor_sources = Counter()
+        # emitting and pledged activities, dropped whenever either is written
+        self.activity_cache = TTLCache(maxsize=8, ttl=config.emitting_activities_ttl)
+        self.prefetch_pool = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="prefetch"
+        )
+        self._snapshot = {}
         
     @property
     def valid_metrics(self):
@@ -221,51 +352,129 @@ class ModelTools:
         self.tools_to_functions = {
             "get_user_emissions": self.get_user_emissions,
             "calculate_emissions": self.calculate_emissions,
+            "calculate_emissions_batch": self.calculate_emissions_batch,
             "make_pledge": self.make_pledge,
             "get_active_pledges": self.get_active_pledges,
-            "get_emitting_activities": lambda: str(self.emitting_activities), 
+            "get_emitting_activities": lambda: str(
+                self.prefetched("emitting_activities")
+            ), 
             #string instead of object for the model
-            "get_user_info": lambda: str(self.user_info)
+            "get_user_info": lambda: str(self.prefetched("user_info"))
         }
 
         return self.tools, self.tools_to_functions, self.prompts
     
+    @property
+    def prefetchable(self) -> dict[str, Callable]:
+        """The cheap, read-only values most turns ask for"""
+        return {
+            "current_emissions": self.current_emissions,
+            "user_info": lambda: self.user_info,
+            "active_pledges": lambda: self.active_pledges,
+            "emitting_activities": self.emitting_activities,
+        }
+
+    def prefetch(self) -> None:
+        """Starts reading every prefetchable value in the background, into a
+        snapshot for the turn that's starting. A snapshot that is already
+        pending, started before the query was transcribed, is kept"""
+        if self._snapshot:
+            return
+        self._snapshot = {
+            name: self.prefetch_pool.submit(read)
+            for name, read in self.prefetchable.items()
+        }
+
+    def prefetched(self, name: str):
+        """The value of `name` from this turn's snapshot, or read now if it
+        wasn't prefetched, or prefetching it failed"""
+        future: Future | None = self._snapshot.get(name)
+        if future is not None:
+            try:
+                return future.result()
+            except Exception:
+                pass
+        return self.prefetchable[name]()
+
+    def drop_snapshot(self) -> None:
+        """Forgets the prefetched values, after a write or at the end of a turn.
+        The profile is read again too, unless a change stream keeps it fresh"""
+        self._snapshot = {}
+        if not self.watching_savior:
+            self.invalidate_savior()
+
     def make_response(self, value: Number) -> str:
         #TODO: HOW SHOULD WE GO ABOUT THIS AND MAKING SURE WE HAVE TO CORRECT UNIT ? 
         return f"{round(value, 2)} Kilograms CO2e"
     
     #Emissions
-    @cached_property
-    def emitting_activities(self) -> list | str:
-        """The summed emissions of the user, grouped by activity"""
-        pipeline_start = {
-            "savior_id": self.savior_id, "activity": {"$nin": self.active_pledges}
-        }
+    def emitting_activities(self, limit: int = 5) -> list | str:
+        """The user's top emitting activities that they haven't pledged to
+        avoid, by their summed emissions
+
+        Args:
+            limit: how many activities to return
+        """
+        cache_key = ("emitting_activities", limit)
+        if (contributers := self.activity_cache.get(cache_key)) is not None:
+            return contributers
+        self.log_rollups.roll_up()
+        pipeline_start = {"activity": {"$nin": sorted(self.pledged_activities())}}
         pipeline_group = {
                     "$group": {
                         "_id": "$activity",
-                        "activity": {"$first": "$activity"},
                         "Total Kilograms CO2e caused": {"$sum": "$co2e"},
                         "activity_unit_type": {"$first": "$activity_unit_type"},
                         # "last_emitted": {"$last": "$date"}
                     }
                 }
         pipeline = [
-            {"$match": pipeline_start},
+            *self.log_rollups.union_pipeline(match=pipeline_start),
             pipeline_group,
             # {"$match": {"emissions": {"$gt": 1}}},
+            {"$sort": {"Total Kilograms CO2e caused": -1}},
+            {"$limit": limit},
+            {"$set": {"activity": "$_id"}},
             {"$unset": "_id"},
-            {"$sort": {"emissions": -1}},
-            {"$limit": 5}
         ]
         # if min_co2:
         #     pipeline.append({"$match": {"emissions": {"$gt": min_co2}}})
-        contributers = list(self.emission_logs.aggregate(pipeline=pipeline))
-        return contributers or "No emitting activites found"
+        contributers = list(self.log_rollups.rollups.aggregate(pipeline=pipeline))
+        contributers = contributers or "No emitting activites found"
+        self.activity_cache.set(cache_key, contributers)
+        return contributers
+
+    def pledged_activities(self) -> set:
+        """The activities the user has pledged to avoid"""
+        if (activities := self.activity_cache.get("pledged_activities")) is None:
+            activities = set(
+                self.pledges.distinct("activity", {"savior_id": self.savior_id})
+            )
+            self.activity_cache.set("pledged_activities", activities)
+        return activities
     
     @property
-    def savior(self):
-        return self.saviors.find_one({"savior_id": self.savior_id})
+    def savior(self) -> dict:
+        """The user's profile, fetched once a turn and kept until invalidated"""
+        if (savior := self._savior) is None:
+            savior = self.saviors.find_one({"savior_id": self.savior_id})
+            self._savior = savior
+        return savior
+
+    def invalidate_savior(self) -> None:
+        """Drops the cached profile so the next access fetches it again"""
+        self._savior = None
+
+    def watch_savior(self) -> None:
+        """Invalidates the cached profile whenever it changes in the database.
+        Change streams need a replica set, this gives up without one"""
+        pipeline = [{"$match": {"fullDocument.savior_id": self.savior_id}}]
+        try:
+            with self.saviors.watch(pipeline, full_document="updateLookup") as stream:
+                for _ in stream:
+                    self.invalidate_savior()
+        except pymongo.errors.PyMongoError as e:
+            logging.warning(f"Stopped watching the savior profile: {e!r}")
     
     @property
     def user_info(self):
@@ -287,20 +496,145 @@ class ModelTools:
         co2e = document["co2e"]
         new_total = previous_emissions + co2e
         
+        created = self.logged_at()
         self.emission_logs.insert_one(
             {
                 "savior_id": self.savior_id,
-                "created": datetime.now(tz=timezone.utc), 
+                "created": created,
                 **document
             }
         )
+        self.drop_snapshot()
+        self.activity_cache.invalidate()
+        self.increment_totals(co2e, created)
         return co2e, new_total
-        
+
+    @staticmethod
+    def period_start(period: str, now: datetime) -> datetime:
+        """When the `period` containing `now` started"""
+        if period == "historical":
+            return datetime.min.replace(tzinfo=timezone.utc)
+        today = datetime(
+            year=now.year, month=now.month, day=now.day, tzinfo=timezone.utc
+        )
+        if period in ["today", "day"]:
+            return today
+        elif period == "week":
+            return today - timedelta(days=now.weekday())
+        elif period == "month":
+            return today.replace(day=1)
+        elif period == "year":
+            return today.replace(month=1, day=1)
+        raise ValueError(
+            "That is NOT a valid function call, "
+            "ask the user what time period to search for emissions from"
+        )
+
+    def period_counter(self, period: str, now: datetime) -> dict:
+        """Selects the running total of the `period` containing `now`"""
+        return {
+            "savior_id": self.savior_id,
+            "period": period,
+            "period_start": self.period_start(period, now),
+        }
+
+    @staticmethod
+    def logged_at() -> datetime:
+        """Now, to the millisecond like the database keeps it, so the time a
+        log was created compares the same before and after it's written"""
+        now = datetime.now(tz=timezone.utc)
+        return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+    def totals_updates(self, co2e: Number, created: datetime) -> list[pymongo.UpdateOne]:
+        """Writes adding emissions logged at `created` to the running total
+        of every period. Totals already counting up to `created`, which
+        were summed from logs including these, are left alone"""
+        return [
+            pymongo.UpdateOne(
+                {
+                    **self.period_counter(period, created),
+                    "counted_until": {"$lt": created},
+                },
+                {"$inc": {"co2e": co2e}},
+            )
+            for period in EMISSION_PERIODS
+        ]
+
+    def increment_totals(self, co2e: Number, created: datetime) -> None:
+        """Adds newly logged emissions to the running total of every period.
+        Totals that don't exist yet are left alone, they're built from
+        the logs, which include these emissions, when first read"""
+        self.emission_totals.bulk_write(
+            self.totals_updates(co2e, created), ordered=False
+        )
+
+    @staticmethod
+    def seed_total(seeding: ObjectId, counted_until: datetime) -> dict:
+        """Creates an empty running total that emissions logged after
+        `counted_until` are added to, while `seeding` sums the ones before"""
+        return {
+            "$setOnInsert": {
+                "co2e": 0, "counted_until": counted_until, "seeding": seeding
+            }
+        }
+
+    @staticmethod
+    def seeded_total(co2e: Number) -> dict:
+        """Adds the emissions logged before the running total was created"""
+        return {"$inc": {"co2e": co2e}, "$unset": {"seeding": ""}}
+
+    def older_totals(self, period: str, period_start: datetime) -> dict:
+        return {
+            "savior_id": self.savior_id,
+            "period": period,
+            "period_start": {"$lt": period_start},
+        }
+
+    def period_total(self, period: str) -> Number:
+        """The user's emissions so far this `period`, read from its running total.
+        A period's total is built from the logs once, when it's first read,
+        and replaces the total of the period before it.
+
+        The total is created before the logs are summed, and only the logs
+        up to its creation are, so emissions logged meanwhile are counted once
+        """
+        period = "day" if period == "today" else period
+        now = self.logged_at()
+        counter = self.period_counter(period, now)
+        period_start = counter["period_start"]
+        if (total := self.emission_totals.find_one(counter)) is None:
+            seeding = ObjectId()
+            total = self.emission_totals.find_one_and_update(
+                counter,
+                self.seed_total(seeding, now),
+                upsert=True,
+                return_document=pymongo.ReturnDocument.AFTER,
+            )
+            if total.get("seeding") == seeding:
+                co2e = self.aggregate_emissions(date_start=period_start, until=now)
+                total = self.emission_totals.find_one_and_update(
+                    counter,
+                    self.seeded_total(co2e),
+                    return_document=pymongo.ReturnDocument.AFTER,
+                )
+                self.emission_totals.delete_many(self.older_totals(period, period_start))
+        if "seeding" in total:
+            # another read is still building it
+            return self.aggregate_emissions(date_start=period_start)
+        return total["co2e"]
+
+    def aggregate_emissions(
+        self, date_start: datetime, until: datetime | None = None
+    ) -> Number:
+        """Sums the user's logged emissions since `date_start`, from the
+        daily rollups and whatever logs aren't rolled up yet"""
+        return self.log_rollups.total_since(date_start=date_start, until=until)
 
     def get_emission_factor(self, activity: str, activity_unit_type: str) -> dict:
         """Get an emission factor from the database given a sequency of words (query)
-        and the unit type to search for. The emission factor is retreived through
-        semantic search
+        and the unit type to search for. Activities named exactly like a factor,
+        or one of its aliases, are looked up directly, otherwise the emission
+        factor is retreived through semantic search
         
         Args:
             activity: A query or sequence of descriptive words to match emission
@@ -311,24 +645,62 @@ class ModelTools:
             
         Returns: A dictionary containing info needed to calculate emissions
         """
+        if (emission_factor := self.lookup_emission_factor(
+            activity, activity_unit_type
+        )):
+            return emission_factor
         query_embeddings = self.get_embeddings(text=activity)
-
+        if self.factor_index is not None:
+            return self.search_factor_index(
+                query_embeddings, activity, activity_unit_type
+            )
         result = self.emission_factors.aggregate(
-            [
-                {
-                    "$vectorSearch": {
-                        "queryVector": query_embeddings,
-                        "path": "INSERT PATH HERE",
-                        "numCandidates": 20,
-                        "index": "emissionFactorsSimilarity",
-                        "limit": 1,
-                        "filter": {"unit_types": activity_unit_type, "source": "partners"}
-                    }
-                },
-            ]
+            self.vector_search_pipeline(query_embeddings, activity_unit_type)
         )
-        return result
+        emission_factor = next(result, None)
+        if emission_factor is None:
+            raise ValueError(f"No emission factor was found for `{activity}`")
+        self.factor_sources["vector_search"] += 1
+        return emission_factor
     
+    def lookup_emission_factor(
+        self, activity: str, activity_unit_type: str
+    ) -> dict | None:
+        """The emission factor named exactly like `activity`, if any"""
+        if self.factor_lookup is not None and (
+            emission_factor := self.factor_lookup.get(activity, activity_unit_type)
+        ):
+            self.factor_sources["name"] += 1
+            return emission_factor
+
+    def search_factor_index(
+        self, query_embeddings: list, activity: str, activity_unit_type: str
+    ) -> dict:
+        """The closest emission factor to `query_embeddings` in the local index"""
+        (matches,) = self.factor_index.search(
+            query_embeddings, k=1, unit_type=activity_unit_type
+        )
+        if not matches:
+            raise ValueError(f"No emission factor was found for `{activity}`")
+        self.factor_sources["local_index"] += 1
+        return matches[0]
+
+    def vector_search_pipeline(
+        self, query_embeddings: list, activity_unit_type: str
+    ) -> list:
+        return [
+            {
+                "$vectorSearch": {
+                    "queryVector": query_embeddings,
+                    "path": self.embedding_path,
+                    "numCandidates": 20,
+                    "index": "emissionFactorsSimilarity",
+                    "limit": 1,
+                    "filter": {"unit_types": activity_unit_type, "source": "partners"}
+                }
+            },
+        ]
+
     # def aggregate_logs(self, match: dict) -> Number:
     #     """Helper to aggregate logs with a $match selection"""
     #     emissions = self.emission_logs.aggregate(
@@ -345,6 +717,20 @@ class ModelTools:
     #     emissions = emissions.next()["emissions"] if emissions.alive else 0
     #     return emissions
     
+    def _resolve_unit(
+        self, activity_unit: str, savior: dict | None = None
+    ) -> tuple[str, str]:
+        """The unit type of an activity unit, and the unit to request it in.
+        Money is in the currency of `savior`, the cached profile by default"""
+        if activity_unit == "money":
+            return "money", (savior or self.savior)["currency"]
+        elif activity_unit not in ["kWh", "g", "kg", "lb", "t", "ton"]:
+            raise ValueError(
+                "The unit for activity must be `money` or a valid weight metric"
+            )
+        else: 
+            return "weight", activity_unit
+
     def _calculate(
         self, activity: str, activity_value: Number, activity_unit: str
     ) -> dict:
@@ -357,36 +743,99 @@ class ModelTools:
             
         Returns: A dictionary with info to log to the database or inform the model
         """
-        if activity_unit == "money":
-            activity_unit_type = "money"
-            activity_unit = self.savior["currency"]
-        elif activity_unit not in ["kWh", "g", "kg", "lb", "t", "ton"]:
-            raise ValueError(
-                "The unit for activity must be `money` or a valid weight metric"
-            )
-        else: 
-            activity_unit_type = "weight"
-            
+        activity_unit_type, activity_unit = self._resolve_unit(activity_unit)
         emission_factor = self.get_emission_factor(
             activity=activity, activity_unit_type=activity_unit_type
         )
-        activity_id = emission_factor["activity_id"]
         emissions = self.ghg_calculator(
             value=activity_value,
-            activity_id=activity_id,
+            activity_id=emission_factor["activity_id"],
             unit_type=activity_unit_type,
             unit=activity_unit,
         )
+        return self.calculation(
+            emissions=emissions,
+            emission_factor=emission_factor,
+            activity=activity,
+            activity_value=activity_value,
+            activity_unit_type=activity_unit_type,
+            activity_unit=activity_unit,
+        )
+
+    @staticmethod
+    def calculation(
+        emissions: dict,
+        emission_factor: dict,
+        activity: str,
+        activity_value: Number,
+        activity_unit_type: str,
+        activity_unit: str,
+    ) -> dict:
+        """The info to log about an activity's estimated `emissions`"""
         return {
-            **emissions, 
+            **emissions,
             "activity_unit_type": activity_unit_type,
-            "activity_id": activity_id,
+            "activity_id": emission_factor["activity_id"],
             "activity": emission_factor["activity"],
             "activity_unit": activity_unit,
             "activity_value": activity_value,
             "tool_call_query": activity
         }
 
+    def _calculate_many(self, activities: list[dict]) -> list[dict]:
+        """`_calculate` for many activities at once. Each distinct activity's
+        emission factor is looked up once, and all estimates are made
+        with a single batch request
+
+        Args:
+            activities: dictionaries of the keyword arguments to `_calculate`
+
+        Returns: A dictionary per activity, in order, like the ones `_calculate`
+        returns, or with an `error` if its estimate failed
+        """
+        # activities that fail are kept in their place with an `error`
+        emission_factors, resolved, calculations = {}, [], {}
+        for i, activity in enumerate(activities):
+            try:
+                activity_unit_type, activity_unit = self._resolve_unit(
+                    activity["activity_unit"]
+                )
+                key = (activity["activity"], activity_unit_type)
+                if key not in emission_factors:
+                    emission_factors[key] = self.get_emission_factor(
+                        activity=activity["activity"],
+                        activity_unit_type=activity_unit_type,
+                    )
+            except ValueError as e:
+                calculations[i] = {"error": str(e), "tool_call_query": activity["activity"]}
+                continue
+            resolved.append((i, key, activity_unit))
+        estimates = self.ghg_calculator.batch(
+            [
+                {
+                    "value": activities[i]["activity_value"],
+                    "activity_id": emission_factors[key]["activity_id"],
+                    "unit_type": key[1],
+                    "unit": activity_unit,
+                }
+                for i, key, activity_unit in resolved
+            ]
+        )
+        for (i, key, activity_unit), emissions in zip(resolved, estimates):
+            activity = activities[i]
+            if "error" in emissions:
+                calculations[i] = {**emissions, "tool_call_query": activity["activity"]}
+                continue
+            calculations[i] = self.calculation(
+                emissions=emissions,
+                emission_factor=emission_factors[key],
+                activity=activity["activity"],
+                activity_value=activity["activity_value"],
+                activity_unit_type=key[1],
+                activity_unit=activity_unit,
+            )
+        return [calculations[i] for i in range(len(activities))]
+
     def calculate_emissions(
         self,
         activity: str,
@@ -424,6 +873,47 @@ class ModelTools:
             return (f"Emissions calculated: {self.make_response(co2e)}. "
                     f"User's leftover budget if activity is taken: {remaining_budget}")
 
+    def calculate_emissions_batch(
+        self, activities: list[dict], update_user_emissions: bool = False
+    ) -> str:
+        """`calculate_emissions` for a list of activities, logging all of them
+        with one write when updating user emissions
+
+        Args:
+            activities: dictionaries with an `activity`, `activity_value`
+            and `activity_unit` each
+            update_user_emissions: Whether or not to upate the user's emission logs.
+
+        Returns: a string for the model to respond to the user with
+        """
+        calculations = self._calculate_many(activities)
+        calculated = [c for c in calculations if "error" not in c]
+        co2e = sum(c["co2e"] for c in calculated)
+        curr_emissions = self.get_user_emissions("current", from_tool_call=False)
+        if update_user_emissions and calculated:
+            created = self.logged_at()
+            self.emission_logs.insert_many(
+                [{"savior_id": self.savior_id, "created": created, **c} for c in calculated]
+            )
+            self.drop_snapshot()
+            self.activity_cache.invalidate()
+            self.increment_totals(co2e, created)
+        results = "; ".join(
+            f"{c['tool_call_query']}: Error: {c['error']}" if "error" in c
+            else f"{c['tool_call_query']}: {self.make_response(c['co2e'])}"
+            for c in calculations
+        )
+        budget_left = self.make_response(
+            self.savior["emissions_budget"] - (co2e + curr_emissions)
+        )
+        if update_user_emissions:
+            return (f"Emissions updated: {results}. "
+                    f"Total: {self.make_response(co2e)}. "
+                    f"CO2e Budget left: {budget_left}")
+        return (f"Emissions calculated: {results}. "
+                f"Total: {self.make_response(co2e)}. "
+                f"User's leftover budget if activities are taken: {budget_left}")
+
     def get_user_emissions(
         self,
         period: str | None = None,
@@ -439,41 +929,10 @@ class ModelTools:
         Returns: The user's total emissions since the specified time
         """
 
-        if period:
-            if period == "current": 
-                tracking_freq = self.savior["emission_frequency"] 
-                return self.get_user_emissions(
-                    period=tracking_freq, from_tool_call=from_tool_call
-                )
-            elif period == "historical":
-                date_start = datetime.min
-            else:
-                now = datetime.now(tz=timezone.utc)
-                if period in ["today", "day"]:
-                    date_start = datetime(
-                        year=now.year, 
-                        day=now.day, 
-                        month=now.month, 
-                        tzinfo=timezone.utc
-                    )
-                elif period == "week":
-                    date_start = now - timedelta(days=now.weekday() % 7)
-                    date_start -= timedelta(
-                        hours=now.hour, minutes=now.minute, seconds=now.second
-                    )
-                elif period == "month":
-                    date_start = datetime(
-                        year=now.year, month=now.month, day=1, tzinfo=timezone.utc
-                    )
-                elif period == "year":
-                    date_start = datetime(
-                        year=now.year, month=1, day=1, tzinfo=timezone.utc
-                    )
-                else:
-                    raise ValueError(
-                        "That is NOT a valid function call, "
-                        "ask the user what time period to search for emissions from"
-                    )
+        if period == "current":
+            emissions = self.prefetched("current_emissions")
+        elif period:
+            emissions = self.period_total(period)
         elif time_delta:
             # time_delta = {
             #     (time + "s" if not time.endswith("s") else time): float(val)
@@ -482,24 +941,17 @@ class ModelTools:
             #     ]
             # }
             date_start = datetime.now(tz=timezone.utc) - timedelta(**time_delta)
+            emissions = self.aggregate_emissions(date_start=date_start)
             
-        emissions = self.emission_logs.aggregate(
-            [
-                {"$match": {"savior_id": self.savior_id, "date": {"$gt": date_start}}},
-                {
-                    "$group": {
-                        "_id": None,
-                        "emissions": {"$sum": "$co2e"},
-                    }
-                },
-            ]
-        )
-        emissions = emissions.next()["emissions"] if emissions.alive else 0
         if from_tool_call:
             return self.make_response(emissions)
         else:
             return emissions
     
+    def current_emissions(self) -> Number:
+        """The user's emissions so far in their tracking period"""
+        return self.period_total(self.savior["emission_frequency"])
+
     #Pledges
     @property
     def active_pledges(self):
@@ -528,7 +980,7 @@ class ModelTools:
             activity_value: the amount of `activity` done
             pledge_name: A unique name for the pledge            
         """
-        if pledge_name in self.active_pledges:
+        if pledge_name in self.prefetched("active_pledges"):
             raise ValueError(f"That pledge name is taken already. " 
                              "Kindly ask the user to specify another name")
         calculation = self._calculate(
@@ -554,10 +1006,40 @@ class ModelTools:
             "tool_call_query": activity,
         }
         self.pledges.insert_one(pledge)
+        self.drop_snapshot()
+        self.activity_cache.invalidate()
+        if self.pledge_scheduler is not None:
+            self.pledge_scheduler.add(pledge)
         impact = self.make_response(co2e_factor)
         return (f"Success. Pledge name: {pledge_name}, "
                 f"Emissions avoided every {pledge_frequency}: {impact}")
 
+    def pledge_impacts_pipeline(self, pledge_names: list[str]) -> list:
+        """Stages summing the impact of the user's pledges, by name. When
+        accruing pledges on read, the periods since each pledge was last
+        updated are credited first"""
+        match = {"savior_id": self.savior_id}
+        if pledge_names: 
+            match["pledge_name"] = {
+                "$in": [name.lower() for name in pledge_names]
+            }
+        accrual = (
+            accrual_stages(datetime.now(tz=timezone.utc))
+            if self.accrue_pledges else []
+        )
+        return [
+            {"$match": match},
+            *accrual,
+            {
+                "$group": {
+                    "_id": "$pledge_name",
+                    "pledge_name": {"$first": "$pledge_name"},
+                    "Total impact (Kilograms CO2e)": {"$sum": "$impact"},
+                },
+            },
+            {"$unset": "_id"}
+        ]
+
     def get_active_pledges(self, pledge_names: list[str] = []) -> list:
         """Get the active pledges of the user along with their total impacts,
         grouped by name
@@ -569,27 +1051,11 @@ class ModelTools:
         
         #TODO: maybe we should not identify them by pledge names 
         # but instead by activity, so you can just say how's my plastic pledge doing and query it by activity
-        match = {"savior_id": self.savior_id}
-        if pledge_names: 
-            match["pledge_name"] = {
-                "$in": [name.lower() for name in pledge_names]
-            }
-            # if not all(map(lambda x: x in self.active_pledges, pledge_names)):
-                # raise ValueError(f"Recieved invalid pledge names.")
-        
-        pledge_impacts = list(self.pledges.aggregate(
-            [
-                {"$match": match},
-                {
-                    "$group": {
-                        "_id": "$pledge_name",
-                        "pledge_name": {"$first": "$pledge_name"},
-                        "Total impact (Kilograms CO2e)": {"$sum": "$impact"},
-                    },
-                },
-                {"$unset": "_id"}
-            ]
-        ))
+        # if not all(map(lambda x: x in self.active_pledges, pledge_names)):
+            # raise ValueError(f"Recieved invalid pledge names.")
+        pledge_impacts = list(
+            self.pledges.aggregate(self.pledge_impacts_pipeline(pledge_names))
+        )
         
         return str(pledge_impacts) or (f"No pledges with names {pledge_names} were found. " 
                                         "Try listing the user's active pledges to them")
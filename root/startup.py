@@ -0,0 +1,51 @@
+import time
+import logging
+from threading import Lock, current_thread
+from contextlib import contextmanager
+
+
+class StartupTimer:
+    """Times the phases of device startup, including ones that run in
+    background threads, and reports how long each took once each of the
+    `parties` starting up is done"""
+
+    __slots__ = ("started", "phases", "parties", "_lock")
+
+    def __init__(self, parties: int = 1):
+        self.started = time.perf_counter()
+        self.phases = []
+        self.parties = parties
+        self._lock = Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            with self._lock:
+                self.phases.append(
+                    (name, current_thread().name, start - self.started, end - start)
+                )
+
+    def report(self) -> str:
+        """A line per phase with when it started and how long it took"""
+        lines = [
+            f"{name:<24}{thread:<16}+{offset * 1000:8.1f} ms {took * 1000:8.1f} ms"
+            for name, thread, offset, took in sorted(self.phases, key=lambda p: p[2])
+        ]
+        total = time.perf_counter() - self.started
+        return "\n".join(["Startup phases:", *lines, f"total {total * 1000:.1f} ms"])
+
+    def done(self) -> None:
+        """Marks one party as started up, the last one logs the report"""
+        with self._lock:
+            self.parties -= 1
+            last = self.parties == 0
+        if last:
+            self.log()
+
+    def log(self) -> None:
+        # nothing configures logging on the device, warnings are still shown
+        logging.warning(self.report())
@@ -0,0 +1,100 @@
+import pytest
+from threading import Event, Thread
+from types import SimpleNamespace
+from root.device.amulet import Amulet
+from root.model import model
+from root.startup import StartupTimer
+
+
+@pytest.fixture
+def amulet():
+    amulet = Amulet.__new__(Amulet)
+    amulet.startup = StartupTimer()
+    amulet._model, amulet._model_error = None, None
+    amulet._model_ready = Event()
+    return amulet
+
+
+class TestWarmUp:
+    def test_model_waits_for_warm_up(self, amulet):
+        asked, answered = Event(), []
+
+        def ask():
+            asked.set()
+            answered.append(amulet.model)
+
+        query = Thread(target=ask)
+        query.start()
+        asked.wait()
+        query.join(timeout=0.05)
+        assert query.is_alive()  # still warming up
+        amulet._model = "model"
+        amulet._model_ready.set()
+        query.join()
+        assert answered == ["model"]
+
+    def test_warm_up_failure_is_raised(self, amulet, monkeypatch):
+        def broken(*args, **kwargs):
+            raise ConnectionError("no database")
+
+        monkeypatch.setattr(model, "Model", broken)
+        amulet.warm_up("__TESTUSER__")
+        with pytest.raises(ConnectionError, match="no database"):
+            amulet.model
+        assert [name for name, *_ in amulet.startup.phases] == ["import model", "model"]
+
+
+class FakeModel:
+    prefetch_tools = True
+
+    def __init__(self, events):
+        self.events = events
+        self.model_tools = SimpleNamespace(prefetch=lambda: events.append("prefetch"))
+
+    def __call__(self, audio_input, text):
+        self.events.append(("model", text))
+
+    def audio_to_text(self, audio_buffer):
+        self.events.append(("audio_to_text", audio_buffer))
+        return "what did I emit this week?"
+
+
+class FakeAudioTools:
+    has_speech = True
+    recording = b"audio"
+
+    def __init__(self, events, failed=False):
+        self.events = events
+        self.failed = failed
+
+    @property
+    def transcript(self):
+        self.events.append("transcript")
+        if self.failed:
+            raise TimeoutError("segment timed out")
+        return "what did I emit today?"
+
+
+class TestHandleQuery:
+    @pytest.fixture
+    def events(self, amulet):
+        events = []
+        amulet._model = FakeModel(events)
+        amulet._model_ready.set()
+        amulet.stream_responses = False
+        return events
+
+    def test_prefetch_starts_before_the_transcript_is_awaited(self, amulet, events):
+        amulet.audio_tools = FakeAudioTools(events)
+        amulet.handle_query()
+        assert events == ["prefetch", "transcript", ("model", "what did I emit today?")]
+
+    def test_failed_segment_falls_back_to_the_recording(self, amulet, events):
+        amulet.audio_tools = FakeAudioTools(events, failed=True)
+        amulet.handle_query()
+        assert events == [
+            "prefetch",
+            "transcript",
+            ("audio_to_text", b"audio"),
+            ("model", "what did I emit this week?"),
+        ]
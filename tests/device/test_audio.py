@@ -1,5 +1,10 @@
 import pytest
+import numpy as np
+from io import BytesIO
+from collections import deque
+from threading import Event
 from root.device.audio import AudioTools
+from root.device.vad import VoiceActivityDetector
 from config import Config
 from gpiozero import Button, LED, Device
 from gpiozero.pins.mock import MockFactory
@@ -65,4 +70,86 @@ class TestAudioTools:
         
         
         
-    
\ No newline at end of file
+    
+
+class FakePlayer:
+    """Plays clips instantly, feeding them to the microphone like a speaker"""
+    def __init__(self, hear):
+        self.hear = hear
+
+    def interrupt(self):
+        pass
+
+    def play(self, pcm, priority):
+        self.hear(pcm)
+        done = Event()
+        done.set()
+        return done
+
+
+class FakeButton:
+    """Held down for `presses` reads, each read the user says a second more"""
+    def __init__(self, presses, say):
+        self.presses, self.say = presses, say
+
+    @property
+    def value(self):
+        self.presses -= 1
+        if self.presses >= 0:
+            self.say()
+        return self.presses >= 0
+
+
+class TestRecording:
+    SAMPLE_RATE, CHUNK = 1600, 160
+    WAKE, SPEECH, PREROLL = 7777, 1000, 2000
+
+    def tools(self):
+        audio_tools = AudioTools.__new__(AudioTools)
+        audio_tools.channels, audio_tools.sample_width = 1, 2
+        audio_tools.sample_rate, audio_tools.chunk = self.SAMPLE_RATE, self.CHUNK
+        audio_tools._ring = deque(maxlen=5)
+        audio_tools._capture = None
+        audio_tools.vad = VoiceActivityDetector(
+            sample_rate=self.SAMPLE_RATE, channels=1, threshold_db=-32.0
+        )
+        audio_tools.transcriber = None
+        audio_tools.debug_audio_files = False
+        audio_tools.output_file = "input_query.wav"
+        audio_tools.tts_format = "pcm"
+        audio_tools.player = FakePlayer(hear=lambda pcm: self.hear(audio_tools, pcm))
+        audio_tools.wake_signal = np.full(self.SAMPLE_RATE, self.WAKE, np.int16).tobytes()
+        return audio_tools
+
+    def hear(self, audio_tools, audio: bytes):
+        chunk_bytes = self.CHUNK * 2
+        for start in range(0, len(audio), chunk_bytes):
+            audio_tools._on_audio(audio[start:start + chunk_bytes], self.CHUNK, {}, 0)
+
+    @staticmethod
+    def frames(wav: BytesIO) -> bytes:
+        with wave.open(wav, "rb") as wf:
+            return wf.readframes(wf.getnframes())
+
+    def test_to_wav_round_trip(self):
+        audio_tools = self.tools()
+        audio = np.arange(-800, 800, dtype=np.int16).tobytes()
+        wav = audio_tools.to_wav(audio, sample_width=2)
+        with wave.open(wav, "rb") as wf:
+            assert (wf.getnchannels(), wf.getframerate()) == (1, self.SAMPLE_RATE)
+            assert wf.readframes(wf.getnframes()) == audio
+        assert wav.name == "input_query.wav"
+
+    def test_recording_starts_with_the_preroll_not_the_wake_signal(self):
+        audio_tools = self.tools()
+        # said just before the press, more than the ring keeps
+        self.hear(audio_tools, np.full(self.SAMPLE_RATE, self.PREROLL, np.int16).tobytes())
+        speech = np.full(self.SAMPLE_RATE, self.SPEECH, np.int16).tobytes()
+        button = FakeButton(presses=2, say=lambda: self.hear(audio_tools, speech))
+        audio_tools.record_and_write(button)
+        assert audio_tools.has_speech
+        samples = np.frombuffer(self.frames(audio_tools.recording), dtype=np.int16)
+        preroll = audio_tools._ring.maxlen * self.CHUNK
+        assert (samples[:preroll] == self.PREROLL).all()
+        assert (samples[preroll:] == self.SPEECH).all()
+        assert len(samples) == preroll + 2 * self.SAMPLE_RATE
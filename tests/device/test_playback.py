@@ -0,0 +1,50 @@
+from threading import Event
+from root.device.playback import AudioPlayer
+
+
+class FakeStream:
+    """Records what is written, holding the first write until released"""
+    def __init__(self):
+        self.writes = []
+        self.writing, self.release = Event(), Event()
+
+    def write(self, data):
+        self.writing.set()
+        self.release.wait()
+        self.writes.append(data)
+
+
+class FakeEngine:
+    def __init__(self):
+        self.stream = FakeStream()
+
+    def open(self, **kwargs):
+        return self.stream
+
+
+class TestAudioPlayer:
+    def player(self):
+        engine = FakeEngine()
+        return AudioPlayer(engine=engine, sample_rate=24000, frames_per_write=1), engine.stream
+
+    def test_urgent_clips_play_first(self):
+        player, stream = self.player()
+        first = player.play(b"aa")
+        stream.writing.wait()
+        normal = player.play(b"bb")
+        urgent = player.play(b"cc", priority=AudioPlayer.URGENT)
+        stream.release.set()
+        assert first.wait(1) and normal.wait(1) and urgent.wait(1)
+        assert stream.writes == [b"aa", b"cc", b"bb"]
+
+    def test_interrupt_cuts_off_and_drops_queued_clips(self):
+        player, stream = self.player()
+        playing = player.play(b"aaaa")
+        stream.writing.wait()
+        queued = player.play(b"bb")
+        player.interrupt()
+        after = player.play(b"cc")
+        stream.release.set()
+        assert playing.wait(1) and queued.wait(1) and after.wait(1)
+        # the clip that was playing stops after the write in progress
+        assert stream.writes == [b"aa", b"cc"]
@@ -0,0 +1,15 @@
+import pytest
+from root.device.transcription import stitch_transcripts
+
+
+@pytest.mark.parametrize(
+    "transcripts, expected",
+    [
+        (["what are my", "my current emissions"], "what are my current emissions"),
+        (["I bought a", "Bought a shirt."], "I bought a shirt."),
+        (["log ten dollars", "of coffee"], "log ten dollars of coffee"),
+        ([], ""),
+    ]
+)
+def test_stitch_transcripts(transcripts, expected):
+    assert stitch_transcripts(transcripts) == expected
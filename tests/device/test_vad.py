@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from root.device.vad import VoiceActivityDetector
+
+SAMPLE_RATE = 16000
+
+
+def tone(seconds: float, amplitude: int) -> np.ndarray:
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 440 * t)).astype(np.int16)
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(int(SAMPLE_RATE * seconds), dtype=np.int16)
+
+
+class TestVoiceActivityDetector:
+    @pytest.fixture
+    def detector(self):
+        return VoiceActivityDetector(
+            sample_rate=SAMPLE_RATE,
+            channels=1,
+            threshold_db=-32.0,
+            padding_seconds=0.1,
+            auto_stop_seconds=1.0,
+        )
+
+    def test_is_silent(self, detector):
+        assert detector.is_silent(silence(1).tobytes())
+        assert not detector.is_silent(tone(1, 10000).tobytes())
+
+    def test_trim(self, detector):
+        audio = np.concatenate([silence(1), tone(0.5, 10000), silence(1)])
+        trimmed = detector.trim(audio.tobytes())
+        # the speech plus 0.1 seconds of padding on either side
+        assert len(trimmed) // 2 == pytest.approx(SAMPLE_RATE * 0.7, rel=0.05)
+        assert detector.trim(silence(1).tobytes()) == b""
+
+    def test_auto_stop(self, detector):
+        detector.update(silence(2).tobytes())
+        assert not detector.should_stop  # nothing said yet
+        detector.update(tone(0.5, 10000).tobytes())
+        detector.update(silence(0.5).tobytes())
+        assert not detector.should_stop
+        detector.update(silence(0.6).tobytes())
+        assert detector.should_stop
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from root.impacts.cpi import CPITable
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / "average-cpis.csv"
+    path.write_text(
+        "region_code,region_name,2021,2022,2023\n"
+        "US,United States,100,110,125\n"
+        "GB,United Kingdom,90,,100\n"
+    )
+    return path
+
+
+class TestCPITable:
+    def test_lookup(self, csv_file):
+        table = CPITable.from_csv(csv_file)
+        assert table["US", 2022] == 110
+        assert np.isnan(table["GB", 2022])
+        assert table.current_year == 2023
+
+    def test_inflation(self, csv_file):
+        table = CPITable.from_csv(csv_file)
+        assert table.inflation(10, "US", 2021) == pytest.approx(8)
+        inflated = table.inflation_many(
+            values=[10, 10, 5], regions=["US", "GB", "US"], years=[2021, 2021, 2023]
+        )
+        np.testing.assert_allclose(inflated, [8, 9, 5])
+
+    def test_binary_cache(self, csv_file, tmp_path):
+        cache_file = tmp_path / "average-cpis.npz"
+        CPITable.load(csv_file, cache_file)
+        assert cache_file.exists()
+        csv_file.unlink()
+        assert CPITable.load(csv_file, cache_file)["GB", 2023] == 100
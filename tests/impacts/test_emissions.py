@@ -1,20 +1,169 @@
-from root.impacts.emissions import GHGCalculator
+import asyncio
+import httpx
+import numpy as np
 import pytest
+from config import Config
+from root.impacts.cpi import CPITable
+from root.impacts.emissions import GHGCalculator
+
+TEXTILES = "textiles-type_textiles"
+ESTIMATE = {
+    "co2e": 4.2,
+    "co2e_unit": "kg",
+    "constituent_gases": {"co2": 4.0, "ch4": 0.1, "n2o": 0.1},
+}
+
+
+def search_results(*factors):
+    return {"total_results": len(factors), "results": list(factors)}
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self.body = body
+
+    def json(self):
+        return self.body
+
+
+class FakeSession:
+    """Answers searches by region and estimates with canned responses"""
+
+    def __init__(self, factors):
+        self.factors = factors
+        self.searches = []
+        self.posts = []
+        self.missing = set()
+
+    def get(self, url, params, timeout):
+        self.searches.append(params)
+        if params["activity_id"] in self.missing:
+            return FakeResponse(search_results())
+        return FakeResponse(search_results(*self.factors.get(params.get("region"), [])))
+
+    def post(self, url, json, timeout):
+        self.posts.append(json)
+        if url.endswith("/batch"):
+            return FakeResponse({"results": [ESTIMATE for _ in json]})
+        return FakeResponse(ESTIMATE)
+
+    def close(self):
+        pass
+
 
 class TestGHGCalculator:
-    
     @pytest.fixture
-    def calc(self):
-        return GHGCalculator(region="US", currency="usd")
-    
+    def calc(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(Config, "query_cache_file", tmp_path / "cache.sqlite")
+        calc = GHGCalculator(region="US", currency="usd")
+        calc._consumer_price_index = CPITable(
+            regions=np.array(["US", "GB"]),
+            years=np.array([2021, 2023]),
+            cpis=np.array([[100.0, 125.0], [80.0, 100.0]]),
+        )
+        calc.session = FakeSession(
+            {
+                "US": [
+                    {"id": "us-2021", "region": "US", "year": 2021},
+                    {"id": "us-2023", "region": "US", "year": 2023},
+                ],
+                None: [{"id": "gb-2021", "region": "GB", "year": 2021}],
+            }
+        )
+        yield calc
+        calc.close()
+
     @pytest.mark.parametrize(
         "id, value, unit, unit_type",
         [
-            ("textiles-type_textiles", 10, None, "money"),
+            (TEXTILES, 10, None, "money"),
             # ("energy-source") TODO: add a test for each unit_type
         ]
     )
     def test__call__(self, id, value, unit, unit_type, calc):
         res = calc(activity_id=id, value=value, unit=unit, unit_type=unit_type)
         assert res.keys() & {"co2e", "co2", "n2o", "ch4"}
-    
\ No newline at end of file
+        (request,) = calc.session.posts
+        assert request["emission_factor"] == {"id": "us-2023"}
+        assert request["parameters"] == {"money": 10.0, "money_unit": "usd"}
+
+    def test_best_query_is_cached(self, calc):
+        calc.get_best_query(TEXTILES)
+        assert calc.get_best_query(TEXTILES)["id"] == "us-2023"
+        assert len(calc.session.searches) == 1
+
+    def test_region_fallback(self, calc):
+        calc.region = "FR"
+        assert calc.get_best_query(TEXTILES)["id"] == "gb-2021"
+        assert [s.get("region") for s in calc.session.searches] == ["FR", None]
+
+    def test_no_factor(self, calc):
+        calc.session.factors = {}
+        with pytest.raises(ValueError, match=TEXTILES):
+            calc.get_best_query(TEXTILES)
+
+    def test_make_session(self, calc):
+        session = calc.make_session()
+        retry = session.get_adapter(calc.estimation_endpoint).max_retries
+        assert retry.total == calc.retries
+        assert session.headers["Authorization"] == calc.api_auth["Authorization"]
+
+    @pytest.mark.parametrize("status, retried", [(503, True), (429, True), (400, False)])
+    def test_retries(self, calc, status, retried):
+        retry = calc.make_session().get_adapter(calc.estimation_endpoint).max_retries
+        # estimates are posted, and posts are retried like any other request
+        assert retry.is_retry("POST", status) == retried
+
+    def test_acall(self, calc):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            if request.url.path == "/search":
+                region = request.url.params.get("region")
+                return httpx.Response(
+                    200, json=search_results(*calc.session.factors.get(region, []))
+                )
+            return httpx.Response(200, json=ESTIMATE)
+
+        calc._async_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+        async def estimate():
+            try:
+                return await calc.acall(value=10, activity_id=TEXTILES, unit_type="money")
+            finally:
+                await calc.aclose()
+
+        res = asyncio.run(estimate())
+        assert res == {"co2e": 4.2, "co2e_unit": "kg", **ESTIMATE["constituent_gases"]}
+        assert [r.url.path for r in requests] == ["/search", "/estimate"]
+        assert calc.get_best_query(TEXTILES)["id"] == "us-2023"  # shares the cache
+
+    def test_batch_errors_stay_in_place(self, calc):
+        estimates = [
+            {"value": 10, "activity_id": TEXTILES, "unit_type": "money"},
+            {"value": 10, "activity_id": "unknown", "unit_type": "money"},
+            {"value": 5, "activity_id": TEXTILES, "unit_type": "money"},
+        ]
+        calc.session.missing.add("unknown")
+        results = calc.batch(estimates)
+        assert "unknown" in results[1]["error"]
+        assert results[0] == results[2] == calc.format_response(ESTIMATE)
+        (batch,) = calc.session.posts
+        assert [r["parameters"]["money"] for r in batch] == [10, 5]
+
+    def test_batch_without_price_index(self, calc):
+        calc.query_cache.set(
+            ("imported", calc.version, calc.region),
+            {"id": "fr-2023", "region": "FR", "year": 2023},
+        )
+        results = calc.batch(
+            [
+                {"value": 10, "activity_id": "imported", "unit_type": "money"},
+                {"value": 10, "activity_id": TEXTILES, "unit_type": "money"},
+            ]
+        )
+        assert results[0] == {"error": "No consumer price index for `FR` in 2023"}
+        assert results[1]["co2e"] == 4.2
+        (batch,) = calc.session.posts
+        assert [r["emission_factor"]["id"] for r in batch] == ["us-2023"]
@@ -0,0 +1,156 @@
+import math
+import pytest
+from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from root.impacts.pledges import (
+    PledgeScheduler,
+    accrual_stages,
+    period_expression,
+    periods_passed,
+    pledge_period,
+)
+
+
+class TestPledgeScheduler:
+    @pytest.mark.parametrize(
+        "pledge_frequency, period",
+        [
+            ("day", timedelta(days=1)),
+            ("week", timedelta(weeks=1)),
+            ({"hours": 12}, timedelta(hours=12)),
+        ]
+    )
+    def test_pledge_period(self, pledge_frequency, period):
+        assert pledge_period(pledge_frequency) == period
+
+    def test_pops_due_pledges_in_one_batch(self):
+        scheduler = PledgeScheduler(pledges=None)
+        now = datetime.now(tz=timezone.utc)
+        daily, weekly = ObjectId(), ObjectId()
+        for _id, frequency in [(daily, "day"), (weekly, "week")]:
+            scheduler.add(
+                {
+                    "_id": _id,
+                    "co2e_factor": 2,
+                    "pledge_frequency": frequency,
+                    "last_updated": now - timedelta(days=1, minutes=1),
+                }
+            )
+        (update,) = scheduler.pop_due(now)
+        # only matches while the period it credits is still the last one
+        assert update._filter == {
+            "_id": daily,
+            "last_updated": now - timedelta(days=1, minutes=1),
+        }
+        assert update._doc["$inc"] == {"impact": 2, "pledge_streak": 1}
+        # rescheduled for the end of its next period
+        assert scheduler.heap[0][0] == now + timedelta(days=1, minutes=-1)
+        assert scheduler.pop_due(now) == []
+
+    def test_catches_up_missed_periods_at_once(self):
+        scheduler = PledgeScheduler(pledges=None)
+        now = datetime.now(tz=timezone.utc)
+        last_updated = now - timedelta(days=365, hours=1)
+        scheduler.add(
+            {
+                "_id": ObjectId(),
+                "co2e_factor": 0.5,
+                "pledge_frequency": "day",
+                "last_updated": last_updated,
+            }
+        )
+        (update,) = scheduler.pop_due(now)
+        assert update._doc["$inc"] == {"impact": 182.5, "pledge_streak": 365}
+        assert update._doc["$set"] == {
+            "last_updated": last_updated + timedelta(days=365)
+        }
+
+    @pytest.mark.parametrize(
+        "since, periods",
+        [(timedelta(hours=23), 0), (timedelta(days=1), 1), (timedelta(days=9.5), 9)],
+    )
+    def test_periods_passed(self, since, periods):
+        now = datetime.now(tz=timezone.utc)
+        assert periods_passed(now - since, timedelta(days=1), now) == periods
+
+
+def evaluate(expression, doc):
+    """Evaluates the aggregation operators the accrual stages use on `doc`,
+    dates are added to and subtracted in milliseconds like in mongodb"""
+    if isinstance(expression, str) and expression.startswith("$"):
+        value = doc
+        for field in expression[1:].split("."):
+            value = value.get(field) if isinstance(value, dict) else None
+        return value
+    if not isinstance(expression, dict):
+        return expression
+    ((operator, args),) = expression.items()
+    if operator == "$switch":
+        for branch in args["branches"]:
+            if evaluate(branch["case"], doc):
+                return evaluate(branch["then"], doc)
+        return evaluate(args["default"], doc)
+    if operator == "$floor":
+        return math.floor(evaluate(args, doc))
+    values = [evaluate(arg, doc) for arg in args]
+    if operator == "$add":
+        dates = [v for v in values if isinstance(v, datetime)]
+        total = sum(v for v in values if not isinstance(v, datetime))
+        return dates[0] + timedelta(milliseconds=total) if dates else total
+    if operator == "$subtract":
+        difference = values[0] - values[1]
+        if isinstance(difference, timedelta):
+            return difference / timedelta(milliseconds=1)
+        return difference
+    return {
+        "$eq": lambda a, b: a == b,
+        "$ifNull": lambda value, default: default if value is None else value,
+        "$multiply": lambda a, b: a * b,
+        "$divide": lambda a, b: a / b,
+        "$max": max,
+    }[operator](*values)
+
+
+def apply_stages(stages, doc):
+    for stage in stages:
+        if "$set" in stage:
+            doc = {**doc, **{k: evaluate(v, doc) for k, v in stage["$set"].items()}}
+        else:
+            doc = {k: v for k, v in doc.items() if k != stage["$unset"]}
+    return doc
+
+
+class TestAccrual:
+    def test_period_expression(self):
+        branches = period_expression()["$switch"]["branches"]
+        assert {b["case"]["$eq"][1]: b["then"] for b in branches}["week"] == (
+            7 * 24 * 60 * 60 * 1000
+        )
+
+    @pytest.mark.parametrize(
+        "pledge_frequency, since, periods, last_updated",
+        [
+            ("day", timedelta(days=3, hours=2), 3, timedelta(hours=2)),
+            ("week", timedelta(days=6), 0, timedelta(days=6)),
+            ({"hours": 12}, timedelta(days=1, hours=1), 2, timedelta(hours=1)),
+            # a pledge updated after `now` isn't credited negative periods
+            ("day", -timedelta(hours=1), 0, -timedelta(hours=1)),
+        ],
+    )
+    def test_accrual_stages(self, pledge_frequency, since, periods, last_updated):
+        now = datetime(2024, 3, 1, 12, tzinfo=timezone.utc)
+        pledge = {
+            "_id": ObjectId(),
+            "co2e_factor": 0.5,
+            "pledge_frequency": pledge_frequency,
+            "impact": 10,
+            "pledge_streak": 4,
+            "last_updated": now - since,
+        }
+        accrued = apply_stages(accrual_stages(now), pledge)
+        assert accrued == {
+            **pledge,
+            "impact": 10 + periods * 0.5,
+            "pledge_streak": 4 + periods,
+            "last_updated": now - last_updated,
+        }
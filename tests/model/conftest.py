@@ -0,0 +1,46 @@
+import pytest
+from root.cache import TTLCache
+from root.model.tools import ModelTools
+
+
+class FakeCollection:
+    """Returns `documents` for any query, and keeps the pipelines it ran"""
+
+    def __init__(self, name, documents=()):
+        self.name = name
+        self.documents = list(documents)
+        self.pipelines = []
+
+    def find_one(self, *args, **kwargs):
+        return None
+
+    def distinct(self, key, filter):
+        return [d[key] for d in self.documents]
+
+    def aggregate(self, pipeline):
+        self.pipelines.append(pipeline)
+        return iter(self.documents)
+
+
+@pytest.fixture
+def fake_collection():
+    return FakeCollection
+
+
+@pytest.fixture
+def make_tools():
+    """Builds model tools without connecting to anything. Attributes the
+    tools read on every turn get defaults, the rest are given"""
+    def _make_tools(cls=ModelTools, **attributes):
+        model_tools = cls.__new__(cls)
+        defaults = {
+            "savior_id": "__TESTUSER__",
+            "_savior": None,
+            "watching_savior": False,
+            "_snapshot": {},
+            "activity_cache": TTLCache(maxsize=8),
+        }
+        for name, value in {**defaults, **attributes}.items():
+            setattr(model_tools, name, value)
+        return model_tools
+    return _make_tools
@@ -0,0 +1,32 @@
+import pytest
+from root.model.rollups import LogRollups
+
+
+class TestEmittingActivities:
+    @pytest.fixture
+    def model_tools(self, make_tools, fake_collection):
+        return make_tools(
+            pledges=fake_collection("pledges", [{"activity": "beef"}]),
+            log_rollups=LogRollups(
+                logs=fake_collection("logs"),
+                rollups=fake_collection("log_rollups", [{"activity": "flights"}]),
+                savior_id="__TESTUSER__",
+            ),
+        )
+
+    def test_sorts_on_the_summed_emissions(self, model_tools):
+        assert model_tools.emitting_activities() == [{"activity": "flights"}]
+        (pipeline,) = model_tools.log_rollups.rollups.pipelines
+        assert pipeline[0]["$match"]["activity"] == {"$nin": ["beef"]}
+        group = next(stage["$group"] for stage in pipeline if "$group" in stage)
+        sort = next(stage["$sort"] for stage in pipeline if "$sort" in stage)
+        assert list(sort) == ["Total Kilograms CO2e caused"]
+        assert set(sort) <= set(group)
+
+    def test_cached_until_invalidated(self, model_tools):
+        model_tools.emitting_activities()
+        model_tools.emitting_activities()
+        assert len(model_tools.log_rollups.rollups.pipelines) == 1
+        model_tools.activity_cache.invalidate()
+        model_tools.emitting_activities()
+        assert len(model_tools.log_rollups.rollups.pipelines) == 2
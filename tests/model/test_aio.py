@@ -0,0 +1,112 @@
+import asyncio
+from types import SimpleNamespace
+from root.model.aio import AsyncModelTools
+
+
+class SlowLogs:
+    """Holds inserts until released, and records the totals written"""
+
+    def __init__(self):
+        self.inserting, self.release = asyncio.Event(), asyncio.Event()
+        self.inserted, self.writes = [], []
+
+    async def insert_one(self, document):
+        self.inserting.set()
+        await self.release.wait()
+        self.inserted.append(document)
+
+    async def bulk_write(self, requests, ordered):
+        self.writes.extend(requests)
+
+
+class LoggingTools(AsyncModelTools):
+    __slots__ = ()
+
+    async def aget_user_emissions(self, period=None, time_delta=None, from_tool_call=True):
+        return 1
+
+
+class SyncCollection:
+    """Fails the test when a blocking read or write is made"""
+
+    def __getattr__(self, name):
+        raise AssertionError(f"a sync collection was used for `{name}`")
+
+
+class AsyncDatabase:
+    """The async collections logging a calculation reads and writes"""
+
+    def __init__(self):
+        self.profile_reads, self.inserted, self.writes = 0, [], []
+        self.saviors = self.logs = self.emission_totals = self
+
+    async def find_one(self, filter):
+        if "period" in filter:
+            return {"co2e": 1}
+        self.profile_reads += 1
+        return {"currency": "usd", "emissions_budget": 10, "emission_frequency": "day"}
+
+    async def insert_one(self, document):
+        self.inserted.append(document)
+
+    async def bulk_write(self, requests, ordered):
+        self.writes.extend(requests)
+
+
+class EstimatingTools(AsyncModelTools):
+    __slots__ = ()
+
+    async def aget_emission_factor(self, activity, activity_unit_type):
+        return {"activity_id": activity, "activity": activity}
+
+
+class TestAsyncModelTools:
+    def test_cancelled_log_still_adds_to_the_totals(self, make_tools):
+        logs = SlowLogs()
+        model_tools = make_tools(
+            LoggingTools, db=SimpleNamespace(logs=logs, emission_totals=logs)
+        )
+
+        async def cancel_while_logging():
+            log = asyncio.ensure_future(model_tools.alog_emissions({"co2e": 2}))
+            await logs.inserting.wait()
+            log.cancel()
+            logs.release.set()
+            await asyncio.sleep(0.01)
+            return log
+
+        log = asyncio.run(cancel_while_logging())
+        assert log.cancelled()
+        assert len(logs.inserted) == 1
+        assert {w._doc["$inc"]["co2e"] for w in logs.writes} == {2}
+
+    def test_calculations_only_touch_async_collections(self, make_tools):
+        async def acall(value, activity_id, unit_type, unit):
+            assert unit == "usd"
+            return {"co2e": 2.0, "co2e_unit": "kg"}
+
+        db = AsyncDatabase()
+        sync = SyncCollection()
+        model_tools = make_tools(
+            EstimatingTools,
+            db=db,
+            saviors=sync,
+            emission_logs=sync,
+            emission_totals=sync,
+            pledges=sync,
+            ghg_calculator=SimpleNamespace(acall=acall),
+        )
+
+        async def calculate(update_user_emissions):
+            return await model_tools.acalculate_emissions(
+                activity="beef",
+                activity_value=5,
+                activity_unit="money",
+                update_user_emissions=update_user_emissions,
+            )
+
+        updated = asyncio.run(calculate(update_user_emissions=True))
+        calculated = asyncio.run(calculate(update_user_emissions=False))
+        assert updated.endswith("CO2e Budget left: 7.0 Kilograms CO2e")
+        assert calculated.endswith("if activity is taken: 7.0 Kilograms CO2e")
+        assert len(db.inserted) == 1
@@ -0,0 +1,88 @@
+import pytest
+from root.model.tools import ModelTools
+
+EMISSIONS = {"co2e": 2.0, "co2e_unit": "kg", "co2": 2.0, "ch4": None, "n2o": None}
+
+
+class FakeCalculator:
+    """Fails the estimates of `unpriced` activities, like the batch endpoint"""
+
+    def __init__(self):
+        self.batches = []
+
+    def batch(self, estimates):
+        self.batches.append(estimates)
+        return [
+            {"error": "no price index"} if e["activity_id"] == "unpriced" else EMISSIONS
+            for e in estimates
+        ]
+
+
+class FakeLogs:
+    def __init__(self):
+        self.inserted = []
+        self.writes = []
+
+    def insert_many(self, documents):
+        self.inserted.extend(documents)
+
+    def bulk_write(self, requests, ordered):
+        self.writes.extend(requests)
+
+
+class CalculatingTools(ModelTools):
+    __slots__ = ()
+
+    def get_emission_factor(self, activity, activity_unit_type):
+        if activity == "unknown":
+            raise ValueError(f"No emission factor was found for `{activity}`")
+        return {"activity_id": activity, "activity": activity}
+
+    def current_emissions(self):
+        return 1.0
+
+
+class TestCalculateEmissionsBatch:
+    @pytest.fixture
+    def model_tools(self, make_tools):
+        return make_tools(
+            CalculatingTools,
+            _savior={"currency": "usd", "emissions_budget": 10},
+            watching_savior=True,
+            ghg_calculator=FakeCalculator(),
+            emission_logs=FakeLogs(),
+            emission_totals=FakeLogs(),
+        )
+
+    def activities(self, *names, unit="money"):
+        return [
+            {"activity": name, "activity_value": 5, "activity_unit": unit}
+            for name in names
+        ]
+
+    def test_errors_stay_in_place(self, model_tools):
+        calculations = model_tools._calculate_many(
+            self.activities("beef", "unknown", "unpriced", "beef")
+        )
+        assert [c.get("error") for c in calculations] == [
+            None, "No emission factor was found for `unknown`", "no price index", None
+        ]
+        assert [c["tool_call_query"] for c in calculations] == [
+            "beef", "unknown", "unpriced", "beef"
+        ]
+        (batch,) = model_tools.ghg_calculator.batches
+        assert [e["activity_id"] for e in batch] == ["beef", "unpriced", "beef"]
+
+    def test_invalid_unit(self, model_tools):
+        (calculation,) = model_tools._calculate_many(self.activities("beef", unit="cups"))
+        assert "valid weight metric" in calculation["error"]
+
+    def test_logs_only_the_calculated(self, model_tools):
+        response = model_tools.calculate_emissions_batch(
+            self.activities("beef", "unknown"), update_user_emissions=True
+        )
+        assert [log["activity"] for log in model_tools.emission_logs.inserted] == ["beef"]
+        assert {w._doc["$inc"]["co2e"] for w in model_tools.emission_totals.writes} == {2.0}
+        assert "unknown: Error: No emission factor" in response
+        assert "Total: 2.0 Kilograms CO2e" in response
+        assert "CO2e Budget left: 7.0 Kilograms CO2e" in response
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from root.cache import TTLCache
+from root.model.factors import (
+    EmbeddingCache, FactorIndex, FactorLookup, normalize_text
+)
+
+
+class TestEmbeddingCache:
+    def test_normalized_text_is_embedded_once(self):
+        calls = []
+
+        def embed(text):
+            calls.append(text)
+            return [1.0, 0.0]
+
+        embeddings = EmbeddingCache(embed=embed, cache=TTLCache())
+        embeddings(text="Coffee!")
+        embeddings(text="  coffee ")
+        assert calls == ["coffee"]
+        assert normalize_text("Bus-ride, daily") == "bus ride daily"
+
+
+class TestFactorIndex:
+    @pytest.fixture
+    def index(self):
+        factors = [
+            {"activity_id": "beef", "unit_types": ["weight", "money"]},
+            {"activity_id": "coffee", "unit_types": ["money"]},
+            {"activity_id": "bus", "unit_types": ["money"]},
+        ]
+        embeddings = [[1.0, 0.0, 0.0], [0.0, 2.0, 0.0], [0.0, 1.0, 1.0]]
+        return FactorIndex(factors=factors, embeddings=embeddings)
+
+    def test_search(self, index):
+        (matches,) = index.search([0.1, 1.0, 0.2], k=2)
+        assert [m["activity_id"] for m in matches] == ["coffee", "bus"]
+
+    def test_queries_are_left_as_they_are(self, index):
+        queries = np.array([[0.1, 1.0, 0.2]], dtype=np.float32)
+        before = queries.copy()
+        index.search(queries)
+        np.testing.assert_array_equal(queries, before)
+
+    def test_batched_search_with_unit_type(self, index):
+        results = index.search([[0.1, 1.0, 0.0], [0.0, 0.0, 1.0]], unit_type="weight")
+        assert [[m["activity_id"] for m in r] for r in results] == [["beef"], ["beef"]]
+        assert index.search([1.0, 0.0, 0.0], unit_type="energy") == [[]]
+
+    def test_empty_catalog(self):
+        class EmptyCollection:
+            def find(self, filter, projection):
+                return iter([])
+
+        index = FactorIndex.from_collection(EmptyCollection(), embedding_path="embedding")
+        assert index.search([[1.0, 0.0], [0.0, 1.0]], unit_type="money") == [[], []]
+
+
+class TestFactorLookup:
+    def test_names_and_aliases(self):
+        beef = {
+            "activity": "Beef",
+            "aliases": ["steak", "ground beef"],
+            "unit_types": ["weight"],
+        }
+        lookup = FactorLookup(factors=[beef])
+        assert lookup.get("beef", "weight") is beef
+        assert lookup.get("Ground-Beef", "weight") is beef
+        assert lookup.get("steak", "money") is None
+        assert lookup.get("chicken", "weight") is None
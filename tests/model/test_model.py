@@ -1,8 +1,200 @@
+import time
+import asyncio
+import inspect
 import pytest
+from types import SimpleNamespace
 from functools import lru_cache
-from root.model.model import Model
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from openai.types.chat import ChatCompletionMessage, ChatCompletionMessageToolCall
+from openai.types.chat.chat_completion_message_tool_call import Function
+from root.model.aio import AsyncModel
+from root.model.model import MessageAssembler, Model, split_sentences
+from root.model.thread import ThreadCompactor
+
+
+def run(result):
+    """The result of a sync call, or of awaiting an async one"""
+    return asyncio.run(result) if inspect.iscoroutine(result) else result
+
+
+def completion(message):
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)])
+
+
+class ScriptedModel(Model):
+    """Replies with `replies` in order, keeping the messages and tools asked with"""
+
+    __slots__ = ("replies", "requests")
+
+    def moderate(self, text):
+        return False
+
+    def get_chat_completion(self, messages, tools=None, stream=False):
+        self.requests.append((list(messages), tools))
+        return completion(self.replies.pop(0))
+
+    def text_to_audio(self, text, output_file=None):
+        return text.encode()
+
+
+def chunk(content=None, tool_calls=None):
+    delta = SimpleNamespace(content=content, tool_calls=tool_calls)
+    return SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+
+
+def tool_delta(index, id=None, name=None, arguments=None):
+    function = SimpleNamespace(name=name, arguments=arguments)
+    return SimpleNamespace(index=index, id=id, function=function)
+
+
+class StreamedModel(Model):
+    """Streams `chunks` as its chat completion"""
+
+    __slots__ = ("chunks",)
+
+    def get_chat_completion(self, messages, tools=None, stream=False):
+        assert stream
+        return iter(self.chunks)
+
+
+class AsyncScriptedModel(AsyncModel):
+    __slots__ = ("replies", "requests")
+
+    async def moderate(self, text):
+        return False
+
+    async def get_chat_completion(self, messages, tools=None, stream=False):
+        return ScriptedModel.get_chat_completion(self, messages, tools, stream)
+
+    async def text_to_audio(self, text, output_file=None):
+        return text.encode()
 
 
 class TestModel:
     def init(*args, **kwargs):
-        return Model(*args, **kwargs)
\ No newline at end of file
+        return Model(*args, **kwargs)
+
+    @pytest.mark.parametrize(
+        "text, sentences, remainder",
+        [
+            ("You emitted 2.5 kilograms", [], "You emitted 2.5 kilograms"),
+            ("Sure. Your budget is", ["Sure."], "Your budget is"),
+            ("Done! Anything else? ", ["Done!", "Anything else?"], ""),
+        ]
+    )
+    def test_split_sentences(self, text, sentences, remainder):
+        assert split_sentences(text) == (sentences, remainder)
+
+    def test_message_assembler_joins_tool_call_deltas(self):
+        assembler = MessageAssembler()
+        chunks = [
+            chunk(tool_calls=[tool_delta(0, id="call_0", name="get_user_")]),
+            chunk(tool_calls=[tool_delta(0, name="emissions", arguments='{"per')]),
+            chunk(tool_calls=[tool_delta(1, id="call_1", name="get_user_info")]),
+            chunk(tool_calls=[tool_delta(0, arguments='iod": "day"}')]),
+            chunk(tool_calls=[tool_delta(1, arguments="{}")]),
+            SimpleNamespace(choices=[]),
+        ]
+        assert [assembler.add(c) for c in chunks] == [[]] * len(chunks)
+        sentences, message = assembler.finish()
+        assert sentences == []
+        assert message.content is None
+        assert [
+            (t.id, t.function.name, t.function.arguments) for t in message.tool_calls
+        ] == [
+            ("call_0", "get_user_emissions", '{"period": "day"}'),
+            ("call_1", "get_user_info", "{}"),
+        ]
+
+    def test_stream_chat_completion(self):
+        model = StreamedModel.__new__(StreamedModel)
+        model.chunks = [
+            chunk("You emitted 2"),
+            chunk(".5 kg today. That's under"),
+            chunk(" budget! Keep"),
+            chunk(" it up"),
+        ]
+        sentences = []
+        message = model.stream_chat_completion([], on_sentence=sentences.append)
+        # the unterminated remainder is sent last
+        assert sentences == [
+            "You emitted 2.5 kg today.", "That's under budget!", "Keep it up"
+        ]
+        assert message.content == " ".join(sentences)
+        assert message.tool_calls is None
+
+    @pytest.mark.parametrize("model_class", [Model, AsyncModel])
+    def test_call_tools(self, model_class):
+        async def fast_async(value):
+            return f"async {value}"
+
+        model = model_class.__new__(model_class)
+        model.tool_pool = ThreadPoolExecutor(max_workers=4)
+        model.tool_timeout = 0.5
+        model.tool_timeouts = {}
+        model.tools_to_functions = {
+            "slow": lambda: time.sleep(1) or "slow",
+            "fast": lambda value: f"fast {value}",
+        }
+        if model_class is AsyncModel:
+            model.tools_to_functions["fast"] = fast_async
+        tool_calls = [
+            SimpleNamespace(
+                id=str(i), function=SimpleNamespace(name=name, arguments=arguments)
+            )
+            for i, (name, arguments) in enumerate(
+                [("slow", "{}"), ("fast", '{"value": 1}'), ("fast", '{"value": 2}')]
+            )
+        ]
+        messages, requested_user_view = run(
+            model.call_tools(tool_calls=tool_calls, messages=[])
+        )
+        assert [m["tool_call_id"] for m in messages] == ["0", "1", "2"]
+        assert messages[0]["content"].startswith("Error: slow took longer")
+        prefix = "async" if model_class is AsyncModel else "fast"
+        assert [m["content"] for m in messages[1:]] == [f"{prefix} 1", f"{prefix} 2"]
+        assert not requested_user_view
+
+    @pytest.mark.parametrize("model_class", [ScriptedModel, AsyncScriptedModel])
+    def test_turn(self, model_class):
+        model = model_class.__new__(model_class)
+        model.prompts = {"chat": "Be brief"}
+        model.tools = [{"type": "function"}]
+        model.tools_to_functions = {"get_user_emissions": lambda period: "2 kg"}
+        model.tool_pool = ThreadPoolExecutor(max_workers=1)
+        model.tool_timeout, model.tool_timeouts = 1, {}
+        model.prefetch_tools = False
+        model.model_tools = SimpleNamespace(drop_snapshot=lambda: None)
+        model.compact_thread = ThreadCompactor(budget=1000)
+        model._current_thread = {"last_interaction": datetime.now(), "thread": []}
+        tool_call = ChatCompletionMessageToolCall(
+            id="0",
+            type="function",
+            function=Function(name="get_user_emissions", arguments='{"period": "day"}'),
+        )
+        model.replies = [
+            ChatCompletionMessage(role="assistant", tool_calls=[tool_call]),
+            ChatCompletionMessage(role="assistant", content="You emitted 2 kg."),
+        ]
+        model.requests = []
+        assert run(model(audio_input=None, text="How much today?")) == b"You emitted 2 kg."
+        roles = [m["role"] for m in model.current_thread]
+        assert roles == ["system", "user", "assistant", "tool", "assistant"]
+        assert model.current_thread[3]["content"] == "2 kg"
+        # tools aren't offered again after a tool call, unless the view was asked for
+        assert [tools for _, tools in model.requests] == [model.tools, None]
+
+    def test_write_tools_are_waited_for(self):
+        model = Model.__new__(Model)
+        model.tool_pool = ThreadPoolExecutor(max_workers=2)
+        model.tool_timeout = 0.1
+        model.tool_timeouts = {"make_pledge": None}
+        model.tools_to_functions = {
+            "make_pledge": lambda: time.sleep(0.3) or "pledged",
+        }
+        tool_call = SimpleNamespace(
+            id="0", function=SimpleNamespace(name="make_pledge", arguments="{}")
+        )
+        (message,), _ = model.call_tools(tool_calls=[tool_call], messages=[])
+        assert message["content"] == "pledged"
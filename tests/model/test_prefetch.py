@@ -0,0 +1,77 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from root.model.tools import ModelTools
+
+
+class CountingTools(ModelTools):
+    __slots__ = ("reads",)
+
+    def current_emissions(self):
+        self.reads += 1
+        return 3
+
+
+class TestPrefetch:
+    @pytest.fixture
+    def model_tools(self, make_tools):
+        # the other prefetched values have no database to read here, and fail
+        return make_tools(
+            CountingTools,
+            prefetch_pool=ThreadPoolExecutor(max_workers=2),
+            _savior={"emissions_budget": 10},
+            reads=0,
+        )
+
+    def test_serves_the_snapshot_until_dropped(self, model_tools):
+        model_tools.prefetch()
+        assert model_tools.prefetched("current_emissions") == 3
+        assert model_tools.prefetched("current_emissions") == 3
+        assert model_tools.reads == 1
+        model_tools.drop_snapshot()
+        assert model_tools.prefetched("current_emissions") == 3
+        assert model_tools.reads == 2
+
+    def test_pending_snapshot_is_kept(self, model_tools):
+        model_tools.prefetch()  # when the button is released
+        pending = model_tools._snapshot
+        model_tools.prefetch()  # when the model is called
+        assert model_tools._snapshot is pending
+        assert model_tools.prefetched("current_emissions") == 3
+        assert model_tools.reads == 1
+
+    def test_reads_again_when_prefetching_failed(self, model_tools):
+        model_tools.prefetch()
+        model_tools._snapshot["user_info"] = model_tools.prefetch_pool.submit(
+            lambda: 1 / 0
+        )
+        assert model_tools.prefetched("user_info") == {
+            "emission_frequency": "day",
+            "emissions_budget": "10 Kilograms CO2e",
+        }
+
+
+class FakeSaviors:
+    def __init__(self):
+        self.reads = 0
+
+    def find_one(self, filter):
+        self.reads += 1
+        return {"savior_id": filter["savior_id"], "emissions_budget": self.reads}
+
+
+class TestSavior:
+    def test_read_once_a_turn(self, make_tools):
+        model_tools = make_tools(saviors=FakeSaviors())
+        assert model_tools.savior["emissions_budget"] == 1
+        assert model_tools.savior["emissions_budget"] == 1
+        model_tools.drop_snapshot()  # the turn ends
+        assert model_tools.savior["emissions_budget"] == 2
+        assert model_tools.saviors.reads == 2
+
+    def test_kept_while_watched(self, make_tools):
+        model_tools = make_tools(saviors=FakeSaviors(), watching_savior=True)
+        model_tools.savior
+        model_tools.drop_snapshot()
+        assert model_tools.savior["emissions_budget"] == 1
+        model_tools.invalidate_savior()  # the change stream saw an update
+        assert model_tools.savior["emissions_budget"] == 2
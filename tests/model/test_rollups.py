@@ -0,0 +1,48 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from root.model.rollups import LogRollups
+
+
+class TestLogRollups:
+    @pytest.fixture
+    def rollups(self, fake_collection):
+        return LogRollups(
+            logs=fake_collection("logs"),
+            rollups=fake_collection("log_rollups"),
+            savior_id="__TESTUSER__",
+        )
+
+    def test_rolls_up_once_a_day(self, rollups):
+        rollups.total_since(datetime.now(tz=timezone.utc) - timedelta(days=3))
+        rollups.total_since(datetime.now(tz=timezone.utc) - timedelta(days=3))
+        assert len(rollups.logs.pipelines) == 1
+
+    def test_partial_first_day_reads_raw_logs(self, rollups):
+        today = rollups.today()
+        date_start = today - timedelta(days=2, hours=6)
+        buckets, _, union = rollups.union_pipeline(match={}, date_start=date_start)
+        assert buckets["$match"]["day"] == {
+            "$gte": today - timedelta(days=2), "$lt": today
+        }
+        raw_logs = union["$unionWith"]["pipeline"][0]["$match"]["$or"]
+        assert raw_logs == [
+            {"created": {"$gte": date_start, "$lt": today - timedelta(days=2)}},
+            {"created": {"$gte": today}},
+        ]
+
+    def test_today_reads_only_raw_logs(self, rollups):
+        date_start = rollups.today() + timedelta(hours=1)
+        buckets, _, union = rollups.union_pipeline(match={}, date_start=date_start)
+        assert buckets["$match"]["day"] == {"$lt": datetime.min}
+        raw_logs = union["$unionWith"]["pipeline"][0]["$match"]
+        assert raw_logs["created"] == {"$gte": date_start}
+
+    def test_raw_logs_until(self, rollups):
+        until = datetime.now(tz=timezone.utc)
+        _, _, union = rollups.union_pipeline(
+            match={}, date_start=rollups.today(), until=until
+        )
+        raw_logs = union["$unionWith"]["pipeline"][0]["$match"]
+        assert raw_logs["$and"] == [
+            {"created": {"$gte": rollups.today()}}, {"created": {"$lte": until}}
+        ]
@@ -0,0 +1,53 @@
+from openai.types.chat import ChatCompletionMessage
+from root.model.thread import ThreadCompactor
+
+
+def turn(i, tool_output="x" * 400):
+    return [
+        {"role": "user", "content": f"question {i}"},
+        ChatCompletionMessage(role="assistant", content=None, tool_calls=None),
+        {"tool_call_id": str(i), "role": "tool", "name": "f", "content": tool_output},
+        {"role": "assistant", "content": f"answer {i}"},
+    ]
+
+
+class TestThreadCompactor:
+    system = {"role": "system", "content": "prompt"}
+
+    def test_under_budget_is_untouched(self):
+        compact = ThreadCompactor(budget=10_000)
+        messages = [self.system, *turn(0)]
+        compacted = compact(messages)
+        assert compacted[0] == self.system
+        assert compacted[2] == {"role": "assistant"}
+        assert compacted[3]["content"] == "x" * 400
+
+    def test_shortens_old_tool_outputs_first(self):
+        compact = ThreadCompactor(budget=160, tool_output_chars=10)
+        compacted = compact([self.system, *turn(0), *turn(1)])
+        assert len(compacted) == 9
+        assert compacted[3]["content"] == "x" * 10 + "..."
+        # the latest turn is kept whole
+        assert compacted[7]["content"] == "x" * 400
+
+    def test_drops_oldest_turns_keeping_the_prompt(self):
+        compact = ThreadCompactor(budget=160, tool_output_chars=10)
+        compacted = compact([self.system, *turn(0), *turn(1), *turn(2)])
+        assert compacted[0] == self.system
+        assert [m["content"] for m in compacted if m["role"] == "user"] == [
+            "question 1", "question 2"
+        ]
+        assert sum(map(compact.message_tokens, compacted)) <= 160
+
+    def test_tool_output_without_text_is_kept(self):
+        compact = ThreadCompactor(budget=160, tool_output_chars=10)
+        parts = {"role": "tool", "tool_call_id": "0", "content": [{"type": "text"}]}
+        empty = {"role": "tool", "tool_call_id": "1"}
+        assert compact.shorten_tool_output(parts) is parts
+        assert compact.shorten_tool_output(empty) is empty
+        # parts are counted by their text, and can't be cut short
+        parts = [{"type": "text", "text": "x" * 400}, {"type": "image_url"}]
+        first, second = turn(0, tool_output=parts), turn(1)
+        assert compact.message_tokens(first[2]) == compact.message_tokens(second[2])
+        compacted = compact([self.system, *first, *second])
+        assert compacted == [self.system, *map(compact.as_dict, second)]
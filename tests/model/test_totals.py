@@ -0,0 +1,140 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from root.model.tools import ModelTools
+
+NOW = datetime(2024, 5, 15, 13, 30, tzinfo=timezone.utc)  # a wednesday
+
+
+class FakeTotals:
+    """Just enough of a collection for running totals, keyed by their counter"""
+
+    def __init__(self):
+        self.totals = {}
+
+    @staticmethod
+    def key(filter):
+        return filter["savior_id"], filter["period"], filter["period_start"]
+
+    def matches(self, filter):
+        total = self.totals.get(self.key(filter))
+        if total is None or "counted_until" not in filter:
+            return total
+        return total if total["counted_until"] < filter["counted_until"]["$lt"] else None
+
+    def find_one(self, filter):
+        return self.totals.get(self.key(filter))
+
+    def find_one_and_update(self, filter, update, upsert=False, return_document=None):
+        total = self.matches(filter)
+        if total is None and upsert:
+            total = self.totals[self.key(filter)] = {**update.get("$setOnInsert", {})}
+        for field, value in update.get("$inc", {}).items():
+            total[field] += value
+        for field in update.get("$unset", {}):
+            total.pop(field)
+        return dict(total)
+
+    def bulk_write(self, requests, ordered):
+        for request in requests:
+            if (total := self.matches(request._filter)) is not None:
+                total["co2e"] += request._doc["$inc"]["co2e"]
+
+    def delete_many(self, filter):
+        self.totals = {
+            key: total for key, total in self.totals.items()
+            if key[1] != filter["period"] or key[2] >= filter["period_start"]["$lt"]
+        }
+
+
+class TotalsTools(ModelTools):
+    """Sums the logs as 5 kg, running `during_sum` while summing"""
+
+    __slots__ = ("sums", "during_sum")
+
+    def aggregate_emissions(self, date_start, until=None):
+        self.sums.append(until)
+        if self.during_sum is not None:
+            self.during_sum()
+        return 5
+
+
+@pytest.fixture
+def model_tools(make_tools):
+    return make_tools(
+        TotalsTools, emission_totals=FakeTotals(), sums=[], during_sum=None
+    )
+
+
+class TestPeriods:
+    @pytest.mark.parametrize(
+        "period, start",
+        [
+            ("today", datetime(2024, 5, 15, tzinfo=timezone.utc)),
+            ("day", datetime(2024, 5, 15, tzinfo=timezone.utc)),
+            ("week", datetime(2024, 5, 13, tzinfo=timezone.utc)),
+            ("month", datetime(2024, 5, 1, tzinfo=timezone.utc)),
+            ("year", datetime(2024, 1, 1, tzinfo=timezone.utc)),
+            ("historical", datetime.min.replace(tzinfo=timezone.utc)),
+        ],
+    )
+    def test_period_start(self, period, start):
+        assert ModelTools.period_start(period, NOW) == start
+
+    def test_period_starts_at_midnight(self):
+        midnight = datetime(2024, 5, 13, tzinfo=timezone.utc)
+        assert ModelTools.period_start("week", midnight) == midnight
+        before = midnight - timedelta(microseconds=1)
+        assert ModelTools.period_start("week", before) == midnight - timedelta(days=7)
+        assert ModelTools.period_start("day", before) == midnight - timedelta(days=1)
+
+    def test_invalid_period(self):
+        with pytest.raises(ValueError):
+            ModelTools.period_start("fortnight", NOW)
+
+    def test_period_counter(self, model_tools):
+        assert model_tools.period_counter("month", NOW) == {
+            "savior_id": "__TESTUSER__",
+            "period": "month",
+            "period_start": datetime(2024, 5, 1, tzinfo=timezone.utc),
+        }
+
+
+class TestRunningTotals:
+    def test_seeded_on_first_read(self, model_tools):
+        assert model_tools.period_total("today") == 5
+        assert model_tools.period_total("day") == 5
+        (until,) = model_tools.sums
+        assert until.microsecond % 1000 == 0  # compared to logs as stored
+        (total,) = model_tools.emission_totals.totals.values()
+        assert total == {"co2e": 5, "counted_until": until}
+
+    def test_increments_only_existing_totals(self, model_tools):
+        model_tools.period_total("week")
+        model_tools.increment_totals(2, model_tools.logged_at() + timedelta(seconds=1))
+        assert model_tools.period_total("week") == 7
+        assert model_tools.period_total("month") == 5  # seeded from the logs
+
+    def test_emissions_logged_while_seeding_count_once(self, model_tools):
+        def log():
+            (until,) = model_tools.sums
+            # already summed, and logged after the total was created
+            model_tools.increment_totals(1, until)
+            model_tools.increment_totals(2, until + timedelta(milliseconds=1))
+
+        model_tools.during_sum = log
+        assert model_tools.period_total("day") == 7
+
+    def test_read_while_seeding_sums_the_logs(self, model_tools):
+        def read():
+            model_tools.during_sum = None
+            assert model_tools.period_total("day") == 5
+
+        model_tools.during_sum = read
+        model_tools.period_total("day")
+        assert model_tools.sums[1] is None  # summed without writing
+
+    def test_replaces_the_previous_period(self, model_tools):
+        yesterday = model_tools.period_counter("day", NOW - timedelta(days=1))
+        model_tools.emission_totals.totals[FakeTotals.key(yesterday)] = {"co2e": 9}
+        model_tools.period_total("day")
+        assert len(model_tools.emission_totals.totals) == 1
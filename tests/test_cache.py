@@ -0,0 +1,102 @@
+import pytest
+from root import cache
+from root.cache import TTLCache, PersistentCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+class TestTTLCache:
+    def test_lru_eviction(self, clock):
+        lru = TTLCache(maxsize=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        assert lru.get("b") is None
+        assert lru.get("a") == 1
+        assert lru.cache_info() == {"hits": 2, "misses": 1, "maxsize": 2, "currsize": 2}
+
+    def test_ttl(self, clock):
+        lru = TTLCache(ttl=60)
+        lru.set("a", 1)
+        clock.now += 59
+        assert lru.get("a") == 1
+        clock.now += 2
+        assert lru.get("a") is None
+
+
+class TestPersistentCache:
+    def test_survives_restart(self, clock, tmp_path):
+        path = tmp_path / "cache.sqlite"
+        key = ("activity-id", "^6", "US")
+        PersistentCache(path).set(key, {"year": 2022})
+        reopened = PersistentCache(path)
+        assert reopened.get(key) == {"year": 2022}
+        assert reopened.cache_info()["hits"] == 1
+
+    def test_ttl_and_eviction(self, clock, tmp_path):
+        persistent = PersistentCache(tmp_path / "cache.sqlite", maxsize=2, ttl=60)
+        for i, key in enumerate("abc"):
+            clock.now += 1
+            persistent.set(key, i)
+        reopened = PersistentCache(persistent.path, maxsize=2, ttl=60)
+        assert reopened.cache_info()["currsize"] == 2
+        assert reopened.get("a") is None
+        clock.now += 61
+        assert reopened.get("c") is None
+
+    def test_created_on_first_use(self, clock, tmp_path):
+        path = tmp_path / "missing" / "cache.sqlite"
+        persistent = PersistentCache(path)
+        assert not path.parent.exists()
+        persistent.set("a", 1)
+        persistent.close()
+        assert PersistentCache(path).get("a") == 1
+
+    def test_evicts_least_recently_used(self, clock, tmp_path):
+        persistent = PersistentCache(tmp_path / "cache.sqlite", maxsize=2)
+        for key in "ab":
+            clock.now += 1
+            persistent.set(key, key)
+        clock.now += 1
+        assert persistent.get("a") == "a"  # served from memory
+        clock.now += 1
+        persistent.set("c", "c")
+        reopened = PersistentCache(persistent.path, maxsize=2)
+        assert reopened.get("a") == "a"
+        assert reopened.get("b") is None
+
+    def test_hits_are_not_written_until_the_next_set(self, clock, tmp_path):
+        persistent = PersistentCache(tmp_path / "cache.sqlite", maxsize=2)
+        persistent.set("a", "a")
+        writes = persistent.db.total_changes
+        for _ in range(3):
+            assert persistent.get("a") == "a"
+        assert persistent.db.total_changes == writes
+
+    def test_last_use_is_written_on_close(self, clock, tmp_path):
+        persistent = PersistentCache(tmp_path / "cache.sqlite", maxsize=2)
+        for key in "ab":
+            clock.now += 1
+            persistent.set(key, key)
+        clock.now += 1
+        persistent.get("a")
+        persistent.close()
+        reopened = PersistentCache(persistent.path, maxsize=2)
+        clock.now += 1
+        reopened.set("c", "c")
+        assert reopened.get("b") is None
+        assert reopened.get("a") == "a"
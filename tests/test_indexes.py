@@ -0,0 +1,50 @@
+import logging
+from collections import defaultdict
+from pymongo.errors import OperationFailure
+from root.indexes import INDEXES, ensure_indexes, plan_stages
+
+
+class FakeCollection:
+    def __init__(self, name, created):
+        self.name, self.created = name, created
+
+    def create_indexes(self, indexes):
+        for index in indexes:
+            # the saviors collection already holds duplicate profiles
+            if index.document.get("unique") and self.name == "saviors":
+                raise OperationFailure("E11000 duplicate key error", code=11000)
+            self.created[self.name].append(index.document["name"])
+
+
+class FakeDatabase(dict):
+    def __init__(self):
+        self.created = defaultdict(list)
+
+    def __missing__(self, name):
+        return FakeCollection(name, self.created)
+
+
+def test_conflicting_index_is_reported(caplog):
+    db = FakeDatabase()
+    with caplog.at_level(logging.WARNING):
+        ensure_indexes(db)
+    (record,) = caplog.records
+    assert "savior_id_1 on saviors" in record.getMessage()
+    assert "saviors" not in db.created
+    assert len(db.created["emission_totals"]) == len(INDEXES["emission_totals"])
+
+
+def test_plan_stages():
+    plan = {
+        "stage": "FETCH",
+        "inputStage": {
+            "stage": "OR",
+            "inputStages": [
+                {"stage": "IXSCAN", "indexName": "savior_id_1_created_-1"},
+                {"stage": "COLLSCAN", "filter": {"pledge_name": {"$eq": ""}}},
+            ],
+        },
+    }
+    assert plan_stages(plan) == ["FETCH", "OR", "IXSCAN", "COLLSCAN"]
+    # slot based engine plans nest the plan one level deeper
+    assert plan_stages({"queryPlan": {"stage": "IXSCAN"}}) == ["IXSCAN"]
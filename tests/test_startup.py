@@ -0,0 +1,59 @@
+import logging
+import pytest
+from threading import Thread
+from root.startup import StartupTimer
+
+
+class TestStartupTimer:
+    def test_phases_in_order_of_start(self):
+        startup = StartupTimer()
+        with startup.phase("gpio"):
+            pass
+        with startup.phase("model"):
+            pass
+        assert [(name, thread) for name, thread, _, _ in startup.phases] == [
+            ("gpio", "MainThread"), ("model", "MainThread")
+        ]
+        gpio, model = startup.phases
+        assert gpio[2] <= model[2]
+        assert all(took >= 0 for *_, took in startup.phases)
+
+    def test_background_phase(self):
+        startup = StartupTimer()
+
+        def warm_up():
+            with startup.phase("model"):
+                pass
+
+        worker = Thread(target=warm_up, name="warm-up")
+        worker.start()
+        worker.join()
+        ((name, thread, _, _),) = startup.phases
+        assert (name, thread) == ("model", "warm-up")
+
+    def test_phase_timed_when_it_fails(self):
+        startup = StartupTimer()
+        with pytest.raises(RuntimeError):
+            with startup.phase("model"):
+                raise RuntimeError
+        assert [name for name, *_ in startup.phases] == ["model"]
+
+    def test_report(self, caplog):
+        startup = StartupTimer()
+        with startup.phase("gpio"):
+            pass
+        with caplog.at_level(logging.WARNING):
+            startup.log()
+        lines = caplog.records[0].getMessage().splitlines()
+        assert lines[0] == "Startup phases:"
+        assert lines[1].startswith("gpio") and "MainThread" in lines[1]
+        assert lines[-1].startswith("total ")
+
+    def test_logged_once_every_party_is_done(self, caplog):
+        startup = StartupTimer(parties=2)
+        with caplog.at_level(logging.WARNING):
+            startup.done()  # the warm-up finished first
+            assert caplog.records == []
+            startup.done()
+        (record,) = caplog.records
+        assert record.getMessage().startswith("Startup phases:")